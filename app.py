@@ -1,8 +1,21 @@
 import streamlit as st
 import pandas as pd
-from pdf_generator import generate_nengajo_pdf, generate_preview_image
+import numpy as np
+from pdf_generator import generate_preview_image, iter_preview_images, new_process_pool, is_pool_broken, THUMBNAIL_DPI
+from page_cache import PageCache
+from pdf_jobs import PdfJobManager, job_key, RUNNING, DONE, CANCELLED, ERROR
+from preprocess import update_derived_columns
+from layout import DERIVED_COLUMNS, ADDRESS_SOURCE_COLUMN
+from ingest import read_table, store_table
+from postal_index import (
+    get_postal_index, check_zipcodes, fill_missing_zipcodes,
+    ZIP_STATUS_COLUMN, ZIP_SUGGEST_COLUMN, ZIP_OK, ZIP_MISSING,
+)
+import instrumentation
 import io
 import os
+from functools import partial
+from concurrent.futures.process import BrokenProcessPool
 
 # ページ設定
 st.set_page_config(page_title="年賀状作成アプリ", layout="wide")
@@ -21,10 +34,214 @@ else:
 
 st.markdown("---")
 
+# ==========================================
+# ⏱️ 計測パネル（サイドバー）
+# ==========================================
+with st.sidebar:
+    st.subheader("⏱️ 処理時間の計測")
+    measure_enabled = st.checkbox("計測を有効にする", value=instrumentation.ENABLED)
+    profile_enabled = st.checkbox("cProfile も取る", value=instrumentation.PROFILE, disabled=not measure_enabled)
+    instrumentation.enable(measure_enabled, profile=profile_enabled)
+
 col1, col2 = st.columns([1.5, 1])
 
+@st.cache_resource
+def get_page_cache():
+    # キーは宛名の内容とレイアウト設定のハッシュなので、セッションをまたいで共有してよい
+    return PageCache()
+
+@st.cache_resource
+def _shared_process_pool():
+    # 描画用のワーカープロセスは1組だけ起動し、一覧表示とPDF作成で使い回す
+    return new_process_pool(os.cpu_count())
+
+def get_process_pool():
+    """共有のプロセスプールを返す（ワーカーが落ちて壊れていたら作り直す）"""
+    pool = _shared_process_pool()
+    if is_pool_broken(pool):
+        _shared_process_pool.clear()
+        pool.shutdown(wait=False, cancel_futures=True)
+        pool = _shared_process_pool()
+    return pool
+
+@st.cache_resource
+def get_job_manager():
+    # 作成中のジョブは画面の再実行をまたいで残り、同じ内容なら使い回される。
+    # プールはジョブごとに get_process_pool から受け取る（壊れたプールを使い続けないように）
+    return PdfJobManager(page_cache=get_page_cache(), workers=os.cpu_count(), executor=get_process_pool)
+
+
+def _format_seconds(sec):
+    return f"{int(sec // 60)}分{int(sec % 60):02d}秒" if sec >= 60 else f"{sec:.0f}秒"
+
+
+@st.fragment(run_every=1)
+def show_pdf_progress(key):
+    """作成中のジョブの進み具合を表示する（1秒ごとにこの部分だけ再描画）"""
+    manager = get_job_manager()
+    job = manager.get(key)
+    if job is None or job.status != RUNNING:
+        # 作り終えたら「PDFを作成」ボタンや保存ボタンの出し分けも変わるので、画面全体を再実行する
+        st.rerun()
+
+    eta = job.eta_seconds()
+    text = f"PDFを作成しています... {job.done} / {job.total} 件"
+    if eta is not None:
+        text += f"（残り約{_format_seconds(eta)}）"
+    st.progress(job.fraction, text=text)
+    if st.button("作成を中止", key=f"cancel_{key}"):
+        manager.cancel(key)
+
+
+def _read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def show_pdf_job(key):
+    """PDF作成ジョブの状態を表示する"""
+    job = get_job_manager().get(key)
+    if job is None:
+        return
+
+    if job.status == RUNNING:
+        show_pdf_progress(key)
+    elif job.status == DONE and job.result_path:
+        st.success(
+            f"作成完了！（{job.total} 件, {_format_seconds(job.elapsed)}, "
+            f"{job.size_bytes / 1024 / 1024:.1f} MB・1枚あたり {job.bytes_per_page / 1024:.1f} KB）"
+        )
+        # PDFはボタンが押されたときに読む（再実行のたびにファイル全体を読み込んで登録し直さないように）
+        st.download_button(
+            label="📥 PDFファイルを保存",
+            data=partial(_read_file, job.result_path),
+            file_name="nengajo_print.pdf",
+            mime="application/pdf",
+            key=f"pdf_download_{key}",
+        )
+    elif job.status == CANCELLED:
+        st.info("PDFの作成を中止しました。")
+    elif job.status == ERROR:
+        st.error(f"PDFの作成に失敗しました: {job.error}")
+
 if 'df_edited' not in st.session_state:
     st.session_state.df_edited = None
+# 表が変わるたびに増やす番号。これが変わったときだけ派生データを作り直す
+if 'df_version' not in st.session_state:
+    st.session_state.df_version = 0
+    st.session_state.view_cache = {}
+
+
+def bump_df_version():
+    st.session_state.df_version += 1
+
+
+def build_preview_labels(df):
+    """セレクトボックスの表示名を表全体でまとめて作る（連名があれば表示）"""
+    renmei = df["連名"].astype(str).fillna("") if "連名" in df.columns else pd.Series("", index=df.index)
+    renmei = renmei.mask(renmei == "nan", "")
+    mark = pd.Series(np.where(df["印刷"].fillna(False).astype(bool), "✅", "⬜"), index=df.index)
+    renmei_part = ("・" + renmei).where(renmei != "", "")
+    return (mark + " " + df["名前"].astype(str).fillna("nan") + renmei_part).tolist()
+
+
+def preview_args(record):
+    """プレビュー画像の生成に渡す (名前, 住所, 連名) を1行分から作る"""
+    renmei = str(record.get("連名", ""))
+    if renmei == "nan": renmei = ""
+    return str(record["名前"]), str(record["住所"]), renmei
+
+
+# 一覧表示の並べ方（1ページに描画するのはこの枚数だけ）
+GALLERY_COLUMNS = 4
+GALLERY_PAGE_SIZE = 24
+
+
+def show_gallery(df, labels):
+    """はがきを縮小版で一覧表示する枠を作り、縮小版を描き込む関数を返す
+
+    描画は表示中のページの分だけ。「開く」を押したはがきは右のプレビューに原寸で表示する。
+    """
+    only_targets = st.checkbox("印刷対象のみ表示", value=False)
+    if only_targets:
+        positions = np.flatnonzero(df["印刷"].fillna(False).astype(bool).to_numpy())
+    else:
+        positions = np.arange(len(df))
+    if len(positions) == 0:
+        st.info("表示する宛名がありません。")
+        return None
+
+    pages = -(-len(positions) // GALLERY_PAGE_SIZE)
+    page = st.number_input(f"ページ（全 {pages} ページ・{len(positions)} 件）", min_value=1, max_value=pages, value=1, step=1)
+    visible = positions[(page - 1) * GALLERY_PAGE_SIZE:page * GALLERY_PAGE_SIZE]
+
+    cols = st.columns(GALLERY_COLUMNS)
+    cells = []
+    for n, pos in enumerate(visible):
+        with cols[n % GALLERY_COLUMNS]:
+            cells.append(st.empty())
+            if st.button("開く", key=f"gallery_open_{pos}", use_container_width=True):
+                st.session_state.gallery_position = int(pos)
+
+    def fill():
+        items = [preview_args(df.iloc[pos]) for pos in visible]
+        with instrumentation.stage("preview.gallery"):
+            try:
+                _fill_cells(items)
+            except BrokenProcessPool:
+                # 描画中にワーカーが落ちた。プールを作り直して、もう1度だけ埋め直す
+                _fill_cells(items)
+
+    def _fill_cells(items):
+        # キャッシュ済みのものから順に、できたはがきを埋めていく
+        for n, img in iter_preview_images(items, dpi=THUMBNAIL_DPI, workers=os.cpu_count(), executor=get_process_pool()):
+            cells[n].image(img, caption=labels[visible[n]], use_container_width=True)
+    return fill
+
+
+def get_zip_check(df, postal_index):
+    """表全体の郵便番号の確認結果を返す（前回の確認から住所が変わった行だけ確認し直す）
+
+    印刷のチェックなど住所以外の編集では、前回の結果をそのまま使う。
+    """
+    source = df[ADDRESS_SOURCE_COLUMN]
+    cache = st.session_state.get("zip_check_cache")
+    if cache is None or cache["index"] is not postal_index:
+        changed = pd.Series(True, index=df.index)
+    else:
+        # 行の追加・削除にも対応できるよう、行番号で前回の住所と突き合わせる
+        changed = cache["source"].reindex(df.index).ne(source).fillna(True)
+
+    if not changed.any():
+        check = cache["check"].reindex(df.index)
+    elif changed.all():
+        check = check_zipcodes(df, postal_index)
+    else:
+        instrumentation.count("postal.check_rows", int(changed.sum()))
+        check = cache["check"].reindex(df.index)
+        check.loc[changed] = check_zipcodes(df.loc[changed], postal_index)
+    st.session_state.zip_check_cache = {"index": postal_index, "source": source, "check": check}
+    return check
+
+
+def get_view(df):
+    """印刷対象・表示名・ジョブのキーを、表の版ごとに1回だけ作る"""
+    version = st.session_state.df_version
+    view = st.session_state.view_cache
+    if view.get("version") != version:
+        with instrumentation.stage("app.view"):
+            target_df = df[df['印刷'] == True]
+            postal_index = get_postal_index()
+            view = {
+                "version": version,
+                "target_df": target_df,
+                "labels": build_preview_labels(df),
+                "job_key": job_key(target_df) if len(target_df) > 0 else None,
+                # 郵便番号データ(KEN_ALL.CSV)があるときだけ、表全体の郵便番号を確認する
+                "zip_check": get_zip_check(df, postal_index) if postal_index is not None else None,
+            }
+        st.session_state.view_cache = view
+    return view
 
 # ==========================================
 # 👈 左カラム：データ編集
@@ -42,6 +259,9 @@ with col1:
             * 夫婦など複数いる場合は**スペースで区切って**ください（例：「花子 一郎」）。
             * 名字が同じなら、下のお名前だけでOKです。
         * **住所**: 郵便番号込みの住所（例：100-0001 東京都...）
+        
+        💡 日本郵便の郵便番号データ（KEN_ALL.CSV）をアプリと同じフォルダに置くと、
+        読み込み時に郵便番号を確認し、未記入のものは住所から補完できます。
         """)
         
         st.markdown("---")
@@ -92,7 +312,9 @@ with col1:
     if uploaded_file is not None:
         if st.session_state.df_edited is None:
             try:
-                df_raw = pd.read_excel(uploaded_file)
+                # 同じ内容のファイルは、前回チェック済みの表をキャッシュから読み込む
+                with instrumentation.stage("excel.read"):
+                    df_raw, cache_key, from_cache = read_table(uploaded_file, profile="app")
                 
                 # 必須列チェック
                 required_cols = ["名前", "住所"]
@@ -101,6 +323,9 @@ with col1:
                 if missing_cols:
                     st.error(f"⚠️ Excelに「{', '.join(missing_cols)}」の列が見つかりません。")
                 else:
+                    if not from_cache:
+                        store_table(df_raw, cache_key)
+
                     # 印刷列の追加
                     if '印刷状態' in df_raw.columns:
                         df_raw.insert(0, "印刷", df_raw['印刷状態'] == '印刷対象')
@@ -111,7 +336,9 @@ with col1:
                     if '連名' not in df_raw.columns:
                         df_raw['連名'] = ""
 
-                    st.session_state.df_edited = df_raw
+                    # 郵便番号・住所の行分け・連名を表全体でまとめて前処理しておく
+                    st.session_state.df_edited = update_derived_columns(df_raw)
+                    bump_df_version()
             except Exception as e:
                 st.error(f"読み込みエラー: {e}")
 
@@ -122,17 +349,43 @@ with col1:
                 st.session_state.df_edited,
                 column_config={
                     "印刷": st.column_config.CheckboxColumn("印刷", default=True),
-                    "連名": st.column_config.TextColumn("連名", help="複数人の場合はスペースで区切ってください（例：花子 一郎）")
+                    "連名": st.column_config.TextColumn("連名", help="複数人の場合はスペースで区切ってください（例：花子 一郎）"),
+                    # 前処理の派生列は表に出さない
+                    **{col: None for col in DERIVED_COLUMNS}
                 },
                 hide_index=True,
                 use_container_width=True,
-                num_rows="fixed"
+                num_rows="fixed",
+                key="address_editor",
+                on_change=bump_df_version
             )
             
-            st.session_state.df_edited = edited_df
-            target_df = edited_df[edited_df['印刷'] == True]
+            # 編集があったときだけ、編集された行の派生列を計算し直す
+            if st.session_state.view_cache.get("version") != st.session_state.df_version:
+                st.session_state.df_edited = update_derived_columns(edited_df)
+            view = get_view(st.session_state.df_edited)
+            target_df = view["target_df"]
             st.write(f"🖨️ 現在の印刷対象: **{len(target_df)}** 件")
 
+            # 郵便番号の確認結果
+            zip_check = view["zip_check"]
+            if zip_check is not None:
+                problems = zip_check[zip_check[ZIP_STATUS_COLUMN] != ZIP_OK]
+                if len(problems) > 0:
+                    st.warning(f"📮 郵便番号の確認が必要な宛名: **{len(problems)}** 件")
+                    with st.expander("確認が必要な宛名を見る"):
+                        st.dataframe(
+                            st.session_state.df_edited.loc[problems.index, ["名前", "住所"]].join(problems),
+                            hide_index=True,
+                            use_container_width=True
+                        )
+                    fillable = (problems[ZIP_STATUS_COLUMN] == ZIP_MISSING) & (problems[ZIP_SUGGEST_COLUMN] != "")
+                    if fillable.any() and st.button(f"未記入の郵便番号を住所から補完 ({int(fillable.sum())} 件)"):
+                        filled_df, _ = fill_missing_zipcodes(st.session_state.df_edited, zip_check)
+                        st.session_state.df_edited = update_derived_columns(filled_df)
+                        bump_df_version()
+                        st.rerun()
+
     # --- プレビュー選択 ---
     if st.session_state.df_edited is not None:
         st.markdown("---")
@@ -140,20 +393,22 @@ with col1:
         
         current_df = st.session_state.df_edited
         
-        # セレクトボックスの表示名を作る（連名があれば表示）
-        def make_label(row):
-            renmei_txt = str(row.get('連名',''))
-            if renmei_txt == "nan": renmei_txt = ""
-            renmei_part = f"・{renmei_txt}" if renmei_txt else ""
-            return f"{'✅' if row['印刷'] else '⬜'} {row['名前']}{renmei_part}"
-
-        preview_options = current_df.apply(make_label, axis=1)
+        # セレクトボックスの表示名（表が変わったときだけ作り直される）
+        preview_options = get_view(current_df)["labels"]
         
-        selected_index = st.selectbox(
-            "確認したい宛名を選択:",
-            current_df.index,
-            format_func=lambda i: preview_options[i]
-        )
+        fill_gallery = None
+        view_mode = st.radio("表示方法", ["1枚ずつ", "一覧"], horizontal=True)
+        if view_mode == "一覧":
+            fill_gallery = show_gallery(current_df, preview_options)
+            selected_index = st.session_state.get("gallery_position")
+            if selected_index is not None and selected_index >= len(current_df):
+                selected_index = None
+        else:
+            selected_index = st.selectbox(
+                "確認したい宛名を選択:",
+                range(len(current_df)),
+                format_func=preview_options.__getitem__
+            )
 
         # ==========================================
         # 👉 右カラム：プレビュー画面
@@ -161,18 +416,20 @@ with col1:
         with col2:
             st.subheader("🖼️ プレビュー")
             if selected_index is not None:
-                record = current_df.iloc[selected_index]
-                name = str(record["名前"])
-                address = str(record["住所"])
-                
                 # 連名を取得（なければ空文字）
-                renmei = str(record.get("連名", ""))
-                if renmei == "nan": renmei = ""
+                name, address, renmei = preview_args(current_df.iloc[selected_index])
                 
                 with st.spinner('プレビュー画像を生成中...'):
                     # 連名データも渡して画像生成
-                    img = generate_preview_image(name, address, renmei)
+                    with instrumentation.profiled(), instrumentation.stage("preview.total"):
+                        img = generate_preview_image(name, address, renmei)
                     st.image(img, caption=f"「{name}」様のイメージ", use_container_width=True)
+            elif view_mode == "一覧":
+                st.caption("一覧の「開く」を押すと、ここに原寸で表示されます。")
+
+        # 一覧の縮小版は、右のプレビューを出してから描き込む
+        if fill_gallery is not None:
+            fill_gallery()
 
     # ==========================================
     # 📥 PDFダウンロードボタン
@@ -183,15 +440,44 @@ with col1:
         
         if uploaded_file is not None:
             if len(target_df) > 0:
-                if st.button("PDFをダウンロード (選択した宛名のみ)", type="primary"):
-                    with st.spinner('PDFを作成しています...'):
-                        pdf_data = generate_nengajo_pdf(target_df.to_dict(orient="records"))
-                        st.download_button(
-                            label="📥 PDFファイルを保存",
-                            data=pdf_data,
-                            file_name="nengajo_print.pdf",
-                            mime="application/pdf"
-                        )
-                        st.success("作成完了！")
+                # PDFは裏で作るので、作成中も表の編集やプレビューを続けられる
+                key = get_view(st.session_state.df_edited)["job_key"]
+                job = get_job_manager().get(key)
+                if job is None or job.status in (CANCELLED, ERROR):
+                    if st.button("PDFを作成 (選択した宛名のみ)", type="primary"):
+                        get_job_manager().submit(key, target_df)
+                show_pdf_job(key)
             else:
-                st.warning("印刷する人が選択されていません。")
\ No newline at end of file
+                st.warning("印刷する人が選択されていません。")
+
+# ==========================================
+# ⏱️ 計測結果（サイドバー）
+# ==========================================
+if instrumentation.ENABLED:
+    with st.sidebar:
+        stats = instrumentation.snapshot()
+        if stats["stages"]:
+            st.dataframe(
+                pd.DataFrame.from_dict(stats["stages"], orient="index"),
+                use_container_width=True
+            )
+        else:
+            st.caption("まだ計測結果はありません。")
+        if stats["counters"]:
+            st.write(stats["counters"])
+        if stats["slow_records"].get("pdf.record"):
+            st.markdown("**🐢 時間のかかった宛名**")
+            st.dataframe(pd.DataFrame(stats["slow_records"]["pdf.record"]), hide_index=True)
+        if stats["profile"]:
+            with st.expander("cProfile の結果"):
+                st.code(stats["profile"], language="text")
+
+        st.download_button(
+            label="📄 計測結果をJSONで保存",
+            data=instrumentation.export_json(),
+            file_name="nengajo_profile.json",
+            mime="application/json"
+        )
+        if st.button("計測結果をリセット"):
+            instrumentation.reset()
+            st.rerun()
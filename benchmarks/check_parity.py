@@ -0,0 +1,168 @@
+"""高速化した処理が、元の処理と同じ結果になるかを確かめる
+
+    python benchmarks/check_parity.py
+    python benchmarks/check_parity.py --rows 5000
+
+食い違いがあれば AssertionError で止まる（終了コードが 0 以外になる）。
+フォントはカレントフォルダの brush.ttf（無ければ標準フォント）を使う。
+"""
+import argparse
+import io
+import os
+import sys
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synth_addressbook import make_addressbook  # noqa: E402
+
+# 正規表現の実装によって結果が変わりやすい住所
+TRICKY_ADDRESSES = [
+    "１２３-４５６７ 東京都千代田区",            # 全角数字の郵便番号
+    "100-0001 東京都千代田区千代田１－１",       # 郵便番号は半角・番地は全角
+    "1000001 東京都千代田区",                    # ハイフンなし
+    "100-0001 東京都 1234567 番地",              # 郵便番号らしき数字が2つ
+    "東京都千代田区 ١٢٣-٤٥٦٧",                   # ASCII 以外の数字（アラビア数字）
+    "東京都千代田区千代田1-1",                   # 郵便番号なし
+    "  100-0001   東京都　千代田区  ",           # 前後と途中の空白
+    "",
+    None,
+]
+
+
+def check_card_fields(rows):
+    """card_fields の結果が、派生列の有無で変わらないことを確かめる"""
+    from layout import card_fields
+    from preprocess import update_derived_columns
+
+    df = make_addressbook(rows, seed=7) if rows else pd.DataFrame(columns=["名前", "住所", "連名"])
+    tricky = pd.DataFrame({
+        "名前": [f"確認{i}" for i in range(len(TRICKY_ADDRESSES))],
+        "住所": TRICKY_ADDRESSES,
+        "連名": ["花子、一郎", "", None, "・", "", "健", "", "", ""],
+    })
+    df = pd.concat([tricky, df[["名前", "住所", "連名"]]], ignore_index=True)
+
+    plain = df.to_dict(orient="records")
+    derived = update_derived_columns(df).to_dict(orient="records")
+    for before, after in zip(plain, derived):
+        expected, actual = card_fields(before), card_fields(after)
+        assert expected == actual, f"card_fields が一致しません: {before.get('住所')!r}: {expected} != {actual}"
+    print(f"✅ card_fields: {len(plain)} 件一致")
+
+
+def _pdf_pages(pdf_bytes):
+    import fitz  # PyMuPDF
+
+    fitz.TOOLS.mupdf_warnings()  # 前の警告を捨てる
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        pages = [(page.get_text(), sorted(font[3] for font in page.get_fonts())) for page in doc]
+    warnings = fitz.TOOLS.mupdf_warnings()
+    assert not warnings, f"PDFの読み込みで警告が出ました: {warnings}"
+    return pages
+
+
+def _font_programs(pdf_bytes):
+    """埋め込まれているフォント本体（FontFile/FontFile2/FontFile3）の数"""
+    import fitz  # PyMuPDF
+
+    programs = set()
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        for xref in range(1, doc.xref_length()):
+            for key in ("FontFile", "FontFile2", "FontFile3"):
+                kind, value = doc.xref_get_key(xref, key)
+                if kind == "xref":
+                    programs.add(value)
+    return len(programs)
+
+
+def check_streaming_pdf(rows, workers):
+    """ストリーミング出力のPDFが、generate_nengajo_pdf と同じページ数・同じ文字・同じフォントになることを確かめる
+
+    write_nengajo_pdf（ファイルへ書き出す）と stream_nengajo_pdf（断片を順に返す。断片をつないで比べる）の両方を見る。
+    """
+    from pdf_generator import generate_nengajo_pdf, stream_nengajo_pdf, write_nengajo_pdf
+    from preprocess import update_derived_columns
+    from records import RecordBatch
+
+    records = RecordBatch.from_frame(update_derived_columns(make_addressbook(rows, seed=11)))
+    serial = generate_nengajo_pdf(records).getvalue()
+    expected = _pdf_pages(serial)
+    expected_fonts = _font_programs(serial)
+    assert len(expected) == rows, f"ページ数が件数と合いません: {len(expected)} != {rows}"
+
+    # チャンクの境目（1件だけのチャンク・端数のチャンク）も含めて確かめる
+    for chunk_size in (1, 97, rows):
+        out = io.BytesIO()
+        pages = write_nengajo_pdf(records, out, chunk_size=chunk_size, workers=workers)
+        assert pages == len(expected), f"ページ数が一致しません (chunk_size={chunk_size}): {pages} != {len(expected)}"
+        streamed = b"".join(stream_nengajo_pdf(records, chunk_size=chunk_size, workers=workers))
+        for label, pdf_bytes in (("write_nengajo_pdf", out.getvalue()), ("stream_nengajo_pdf", streamed)):
+            actual = _pdf_pages(pdf_bytes)
+            assert len(actual) == len(expected), (
+                f"{label} のページ数が一致しません (chunk_size={chunk_size}): {len(actual)} != {len(expected)}"
+            )
+            for n, (want, got) in enumerate(zip(expected, actual), 1):
+                assert want == got, f"{label} の {n} ページ目が一致しません (chunk_size={chunk_size}): {want} != {got}"
+            # チャンクごとに筆文字フォントが埋め込まれていないこと（標準フォントなら 0 のまま）
+            fonts = _font_programs(pdf_bytes)
+            assert fonts == expected_fonts, (
+                f"{label} の埋め込みフォントの数が一致しません (chunk_size={chunk_size}): {fonts} != {expected_fonts}"
+            )
+    print(f"✅ ストリーミング出力（write・stream）: {rows} ページ一致・埋め込みフォント {expected_fonts} 個（workers={workers}）")
+
+
+def check_parallel_pdf(rows, workers):
+    """generate_nengajo_pdf の並列描画が、直列描画と同じページ・同じ埋め込みフォントの数になることを確かめる"""
+    from pdf_generator import generate_nengajo_pdf
+    from preprocess import update_derived_columns
+    from records import RecordBatch
+
+    records = RecordBatch.from_frame(update_derived_columns(make_addressbook(rows, seed=13)))
+    serial = generate_nengajo_pdf(records).getvalue()
+    parallel = generate_nengajo_pdf(records, workers=workers).getvalue()
+    assert _pdf_pages(parallel) == _pdf_pages(serial), "並列描画のページが直列描画と一致しません"
+    fonts, expected_fonts = _font_programs(parallel), _font_programs(serial)
+    assert fonts == expected_fonts, f"埋め込みフォントの数が一致しません: {fonts} != {expected_fonts}"
+    print(f"✅ 並列描画: {rows} ページ一致・埋め込みフォント {fonts} 個（workers={workers}）")
+
+
+def check_cached_pdf(rows, workers):
+    """ページキャッシュを使った生成が、直列描画と同じページ・同じ埋め込みフォントの数になることを確かめる"""
+    from page_cache import PageCache
+    from pdf_generator import generate_nengajo_pdf, generate_nengajo_pdf_cached
+    from preprocess import update_derived_columns
+    from records import RecordBatch
+
+    records = RecordBatch.from_frame(update_derived_columns(make_addressbook(rows, seed=17)))
+    serial = generate_nengajo_pdf(records).getvalue()
+    expected, expected_fonts = _pdf_pages(serial), _font_programs(serial)
+    page_cache = PageCache()
+    # 1回目は全件キャッシュなし、2回目は全件キャッシュ済み
+    for label in ("キャッシュなし", "キャッシュ済み"):
+        cached = generate_nengajo_pdf_cached(records, page_cache, workers=workers).getvalue()
+        assert _pdf_pages(cached) == expected, f"ページキャッシュ（{label}）のページが直列描画と一致しません"
+        fonts = _font_programs(cached)
+        assert fonts == expected_fonts, f"埋め込みフォントの数が一致しません（{label}）: {fonts} != {expected_fonts}"
+    print(f"✅ ページキャッシュ: {rows} ページ一致・埋め込みフォント {expected_fonts} 個（workers={workers}）")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="高速化した処理と元の処理の結果を比べる")
+    parser.add_argument("--rows", type=int, default=2000, help="架空の住所録の件数")
+    parser.add_argument("--pdf-rows", type=int, default=300, help="PDFを比べるときの件数")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="ワーカープロセス数（2以上なら並列描画も確かめる）")
+    args = parser.parse_args(argv)
+    check_card_fields(args.rows)
+    check_streaming_pdf(args.pdf_rows, args.jobs)
+    check_cached_pdf(args.pdf_rows, args.jobs)
+    if args.jobs > 1:
+        check_parallel_pdf(args.pdf_rows, args.jobs)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
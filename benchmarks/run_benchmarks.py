@@ -0,0 +1,262 @@
+"""住所録の読み込み・絞り込み・PDF生成・プレビューの速度を測る
+
+    python benchmarks/run_benchmarks.py --sizes 100 1000 10000 -o bench.json
+    python benchmarks/run_benchmarks.py --sizes 1000 --compare bench.json
+
+各ベンチマークは新しいプロセスで実行するので、ピークメモリ(RSS)は測定ごとの値になる。
+結果は JSON で書き出し、--compare で以前の結果（別のコミットなど）と比べられる。
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synth_addressbook import write_addressbook  # noqa: E402
+
+DEFAULT_SIZES = [100, 1000, 10000, 100000, 1000000]
+FILTER_QUERIES = [
+    (["家族"], None, ""),
+    (None, ["印刷対象", "未印刷"], ""),
+    (None, None, "山田"),
+    (["友人", "会社"], ["印刷済"], "花"),
+]
+# 起動時間の計測に使うスクリプト（毎回まっさらなプロセスで実行する）
+STARTUP_SCRIPT = """
+import json, multiprocessing, time
+from concurrent.futures import ProcessPoolExecutor
+if __name__ == "__main__":
+    record = {"名前": "山田 太郎", "住所": "100-0001 東京都千代田区千代田1-1", "連名": "花子"}
+    t = time.perf_counter()
+    import pdf_generator, pdf_jobs, preprocess, ingest
+    imported = time.perf_counter()
+    pdf_generator.generate_nengajo_pdf([record])
+    rendered = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as ex:
+        ex.submit(pdf_generator._render_pdf_bytes, [record]).result()
+    spawned = time.perf_counter()
+    print(json.dumps({
+        "import_sec": imported - t,
+        "first_pdf_sec": rendered - imported,
+        "worker_first_pdf_sec": spawned - rendered,
+    }))
+"""
+STARTUP_RUNS = 3
+# 値が小さいほど良い指標（それ以外は大きいほど良い）
+LOWER_IS_BETTER = ("_sec", "_ms", "_mb", "_bytes")
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB、macOS はバイト単位
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _open_book(path):
+    from data_manager import DataManager
+    dm = DataManager()
+    with open(path, "rb") as f:
+        ok, message = dm.load_excel(f)
+    if not ok:
+        raise RuntimeError(message)
+    return dm
+
+
+# --- 各ベンチマーク（子プロセスで実行される） ---
+def bench_load_excel(path):
+    import ingest
+    ingest.CACHE_DIR = tempfile.mkdtemp(prefix="nengajo_bench_")
+    t = time.perf_counter()
+    dm = _open_book(path)
+    cold = time.perf_counter() - t
+    t = time.perf_counter()
+    _open_book(path)
+    warm = time.perf_counter() - t
+    return {"rows": len(dm.df), "cold_sec": cold, "cached_sec": warm}
+
+
+def bench_filter(path):
+    dm = _open_book(path)
+    timings = []
+    for groups, statuses, search in FILTER_QUERIES:
+        runs = []
+        for _ in range(5):
+            t = time.perf_counter()
+            dm.get_filtered_data(groups, statuses, search)
+            runs.append(time.perf_counter() - t)
+        timings.append(statistics.median(runs))
+    return {"median_query_ms": statistics.median(timings) * 1000, "max_query_ms": max(timings) * 1000}
+
+
+def bench_pdf(path, limit, workers):
+    from pdf_generator import generate_nengajo_pdf
+    from records import RecordBatch
+    dm = _open_book(path)
+    records = RecordBatch.from_frame(dm.df.head(limit))
+    t = time.perf_counter()
+    pdf = generate_nengajo_pdf(records, workers=workers)
+    elapsed = time.perf_counter() - t
+    size = len(pdf.getbuffer())
+    return {
+        "pages": len(records),
+        "workers": workers,
+        "elapsed_sec": elapsed,
+        "pages_per_sec": len(records) / elapsed if elapsed else None,
+        "output_bytes": size,
+        "bytes_per_page": size / len(records) if records else None,
+    }
+
+
+def bench_preview(path, samples):
+    import pdf_generator
+    dm = _open_book(path)
+    rows = dm.df.head(samples)
+    cold, warm = [], []
+    for _, row in rows.iterrows():
+        args = (str(row["名前"]), str(row["住所"]), str(row.get("連名", "")))
+        t = time.perf_counter()
+        pdf_generator.generate_preview_image(*args)
+        cold.append(time.perf_counter() - t)
+        t = time.perf_counter()
+        pdf_generator.generate_preview_image(*args)
+        warm.append(time.perf_counter() - t)
+    return {
+        "samples": len(cold),
+        "first_ms": cold[0] * 1000,
+        "cold_median_ms": statistics.median(cold) * 1000,
+        "cached_median_ms": statistics.median(warm) * 1000,
+    }
+
+
+def bench_startup():
+    """アプリが使うモジュールの読み込み・最初の1枚・ワーカープロセスの起動にかかる時間"""
+    runs = []
+    for _ in range(STARTUP_RUNS):
+        t = time.perf_counter()
+        out = subprocess.check_output([sys.executable, "-c", STARTUP_SCRIPT], cwd=ROOT, text=True)
+        run = json.loads(out.strip().splitlines()[-1])
+        run["process_sec"] = time.perf_counter() - t
+        runs.append(run)
+    # 1回目はフォント情報のキャッシュ作成などを含むので、中央値を代表値にする
+    return {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+
+
+def _child(queue, func, args):
+    os.chdir(ROOT)
+    try:
+        result = func(*args)
+        result["peak_rss_mb"] = _peak_rss_mb()
+        queue.put(result)
+    except Exception as e:
+        queue.put({"error": repr(e)})
+
+
+def run_isolated(func, *args):
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_child, args=(queue, func, args))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+# --- 結果の保存と比較 ---
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except Exception:
+        return None
+
+
+def compare(current, baseline_path):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    old = {(r["benchmark"], r["size"]): r for r in baseline["results"]}
+    print(f"\n比較: {baseline['meta'].get('commit')} → {current['meta'].get('commit')}")
+    for r in current["results"]:
+        base = old.get((r["benchmark"], r["size"]))
+        if not base:
+            continue
+        for key, value in r.items():
+            if not isinstance(value, (int, float)) or not isinstance(base.get(key), (int, float)) or not base[key]:
+                continue
+            if key in ("size", "rows", "pages", "samples", "workers"):
+                continue
+            change = (value - base[key]) / base[key] * 100
+            worse = change > 0 if key.endswith(LOWER_IS_BETTER) else change < 0
+            mark = "⚠️" if worse and abs(change) >= 10 else "  "
+            print(f"{mark} {r['benchmark']:<8} {r['size']:>8} {key:<18} {base[key]:>12.3f} → {value:>12.3f} ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="年賀状アプリのベンチマーク")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--pdf-limit", type=int, default=2000, help="PDFに描画する最大件数")
+    parser.add_argument("--workers", type=int, default=1, help="PDF生成のワーカー数")
+    parser.add_argument("--preview-samples", type=int, default=20)
+    parser.add_argument("--skip-startup", action="store_true", help="起動時間の計測を省く")
+    parser.add_argument("--workdir", default=os.path.join(ROOT, ".bench_data"), help="生成した住所録の置き場所")
+    parser.add_argument("-o", "--output", default="bench_results.json")
+    parser.add_argument("--compare", default=None, help="比較する以前の結果JSON")
+    args = parser.parse_args()
+
+    os.makedirs(args.workdir, exist_ok=True)
+    results = []
+    if not args.skip_startup:
+        result = {"benchmark": "startup", "size": 0, **bench_startup()}
+        results.append(result)
+        print(json.dumps(result, ensure_ascii=False))
+    for size in args.sizes:
+        path = os.path.join(args.workdir, f"addressbook_{size}.xlsx")
+        if not os.path.exists(path):
+            print(f"住所録を生成中: {size} 件")
+            write_addressbook(path, size)
+
+        benches = [
+            ("load", bench_load_excel, (path,)),
+            ("filter", bench_filter, (path,)),
+            ("pdf", bench_pdf, (path, args.pdf_limit, args.workers)),
+            ("preview", bench_preview, (path, args.preview_samples)),
+        ]
+        for name, func, func_args in benches:
+            result = {"benchmark": name, "size": size, **run_isolated(func, *func_args)}
+            results.append(result)
+            print(json.dumps(result, ensure_ascii=False))
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"結果を保存しました: {args.output}")
+
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
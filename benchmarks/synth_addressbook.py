@@ -0,0 +1,100 @@
+"""ベンチマーク用の架空の住所録を作る
+
+    python benchmarks/synth_addressbook.py 10000 -o book_10000.xlsx
+"""
+import argparse
+import random
+
+import pandas as pd
+
+FAMILY_NAMES = [
+    "佐藤", "鈴木", "高橋", "田中", "伊藤", "渡辺", "山本", "中村", "小林", "加藤",
+    "吉田", "山田", "佐々木", "山口", "松本", "井上", "木村", "林", "清水", "長谷川",
+]
+GIVEN_NAMES = [
+    "太郎", "花子", "一郎", "美咲", "翔太", "さくら", "健", "陽菜", "大輔", "結衣",
+    "誠", "愛", "蓮", "葵", "拓海", "七海", "悠真", "あかり", "颯", "凛",
+]
+PREFECTURES = [
+    ("東京都", ["千代田区", "新宿区", "世田谷区", "八王子市"]),
+    ("大阪府", ["大阪市北区", "泉大津市", "堺市堺区", "豊中市"]),
+    ("神奈川県", ["横浜市中区", "川崎市幸区", "相模原市緑区"]),
+    ("北海道", ["札幌市中央区", "旭川市", "函館市"]),
+    ("福岡県", ["福岡市博多区", "北九州市小倉北区"]),
+]
+TOWNS = ["旭町", "本町", "中央", "緑が丘", "桜木町", "東雲", "南大泉", "西新宿"]
+BUILDINGS = [
+    "", "", "", "コーポ青葉", "メゾン・ド・さくら",
+    "グランドパレス南大泉タワーレジデンスウエスト棟",  # 1ブロックで18文字を超える長い建物名
+    "サンシャインマンション",
+]
+GROUPS = ["家族", "親戚", "友人", "会社", "取引先"]
+STATUSES = ["未印刷", "印刷対象", "印刷済", "除外"]
+
+
+def _zipcode(rng):
+    r = rng.random()
+    code = f"{rng.randint(0, 999):03d}{rng.randint(0, 9999):04d}"
+    if r < 0.10:
+        return ""                              # 郵便番号なし
+    if r < 0.25:
+        return code                            # ハイフンなし
+    return f"{code[:3]}-{code[3:]}"
+
+
+def _address(rng):
+    pref, cities = rng.choice(PREFECTURES)
+    chome = f"{rng.randint(1, 9)}-{rng.randint(1, 30)}-{rng.randint(1, 20)}"
+    parts = [pref + rng.choice(cities) + rng.choice(TOWNS), chome]
+    building = rng.choice(BUILDINGS)
+    if building:
+        parts.append(f"{building}{rng.randint(101, 1205)}号室")
+    zipcode = _zipcode(rng)
+    separator = rng.choice([" ", "　", " "])
+    return (zipcode + " " if zipcode else "") + separator.join(parts)
+
+
+def _renmei(rng, family):
+    count = rng.choices([0, 1, 2, 3, 4], weights=[45, 30, 15, 7, 3])[0]
+    names = []
+    for _ in range(count):
+        given = rng.choice(GIVEN_NAMES)
+        names.append(given if rng.random() < 0.8 else f"{family} {given}")
+    return rng.choice(["・", "、", ","]).join(names)
+
+
+def make_addressbook(rows, seed=0):
+    """DataManager の必須列と 連名 を持つ住所録の DataFrame を返す"""
+    rng = random.Random(seed)
+    records = []
+    for i in range(rows):
+        family = rng.choice(FAMILY_NAMES)
+        records.append({
+            "NO.": str(i + 1),
+            "名前": f"{family} {rng.choice(GIVEN_NAMES)}",
+            "連名": _renmei(rng, family),
+            "印刷状態": rng.choice(STATUSES),
+            "グループ": rng.choice(GROUPS),
+            "住所": _address(rng),
+        })
+    return pd.DataFrame(records, columns=["NO.", "名前", "連名", "印刷状態", "グループ", "住所"])
+
+
+def write_addressbook(path, rows, seed=0):
+    make_addressbook(rows, seed).to_excel(path, index=False, sheet_name="名簿")
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ベンチマーク用の住所録(.xlsx)を作る")
+    parser.add_argument("rows", type=int)
+    parser.add_argument("-o", "--output", default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    path = args.output or f"addressbook_{args.rows}.xlsx"
+    write_addressbook(path, args.rows, args.seed)
+    print(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""住所録(.xlsx)から宛名面のPDFをまとめて作るコマンドライン版
+
+    python cli.py 名簿A.xlsx 名簿B.xlsx -o out --jobs 4
+    python cli.py 名簿.xlsx --group 家族 親戚 --status 印刷対象 未印刷 --mark-printed
+
+Streamlit を読み込まないので、夜間の一括処理などから手軽に呼び出せる。
+"""
+import argparse
+import os
+import sys
+import time
+
+from data_manager import DataManager
+from pdf_generator import write_nengajo_pdf, bytes_per_page, STREAM_CHUNK_SIZE
+from records import RecordBatch
+from postal_index import ZIP_STATUS_COLUMN, ZIP_OK
+
+DEFAULT_STATUSES = ["印刷対象"]
+PRINTED_STATUS = "印刷済"
+
+
+def _log(message):
+    print(message, file=sys.stderr)
+
+
+def process_workbook(path, args):
+    """1冊分の住所録を処理する。成功したら True を返す"""
+    dm = DataManager()
+    with open(path, "rb") as f:
+        ok, message = dm.load_excel(f)
+    if not ok:
+        _log(f"❌ {path}: {message}")
+        return False
+
+    if dm.zip_check is not None:
+        if args.fill_zip:
+            filled = dm.fill_zipcodes()
+            if filled:
+                _log(f"📮 {path}: 郵便番号を {filled} 件補完しました")
+        problems = dm.zip_check[ZIP_STATUS_COLUMN]
+        problems = problems[problems != ZIP_OK].value_counts()
+        if not problems.empty:
+            summary = "、".join(f"{status} {count} 件" for status, count in problems.items())
+            _log(f"⚠️ {path}: 郵便番号の確認が必要です（{summary}）")
+
+    target_df = dm.get_filtered_data(args.group, args.status, args.search)
+    if target_df.empty:
+        _log(f"⚠️ {path}: 条件に合う宛名がありません")
+        return True
+
+    out_path = os.path.join(args.output_dir, os.path.splitext(os.path.basename(path))[0] + ".pdf")
+    start = time.perf_counter()
+    pages = write_nengajo_pdf(
+        RecordBatch.from_frame(target_df), out_path, chunk_size=args.chunk_size, workers=args.jobs
+    )
+    elapsed = time.perf_counter() - start
+    per_page = bytes_per_page(os.path.getsize(out_path), pages) / 1024
+    _log(f"✅ {path} → {out_path}（{pages} 枚, {elapsed:.1f} 秒, 1枚あたり {per_page:.1f} KB）")
+
+    if args.mark_printed:
+        df = dm.df.copy()
+        df.loc[target_df.index, "印刷状態"] = PRINTED_STATUS
+        ok, message = dm.save_excel(df, dm.file_path, incremental=True)
+        _log(f"{'📝' if ok else '❌'} {path}: {message}")
+        return ok
+    return True
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="住所録(.xlsx)から年賀状の宛名面PDFを作る")
+    parser.add_argument("workbooks", nargs="+", help="住所録のExcelファイル（複数指定可）")
+    parser.add_argument("-o", "--output-dir", default=".", help="PDFの出力先フォルダ")
+    parser.add_argument("--group", nargs="*", default=None, help="対象のグループ（省略時はすべて）")
+    parser.add_argument(
+        "--status", nargs="*", default=DEFAULT_STATUSES,
+        help=f"対象の印刷状態（既定: {' '.join(DEFAULT_STATUSES)}、値なしで指定するとすべて）",
+    )
+    parser.add_argument("--search", default="", help="名前に含まれる文字で絞り込む")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="PDF描画のワーカープロセス数（0 でCPU数）")
+    parser.add_argument("--chunk-size", type=int, default=STREAM_CHUNK_SIZE, help="1度に描画する件数")
+    parser.add_argument(
+        "--fill-zip", action="store_true",
+        help="郵便番号データ(KEN_ALL.CSV)から、未記入の郵便番号を住所をもとに補完する（--mark-printed で保存される）",
+    )
+    parser.add_argument(
+        "--mark-printed", action="store_true",
+        help=f"出力した宛名の印刷状態を「{PRINTED_STATUS}」にして住所録を保存する",
+    )
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    failed = 0
+    for path in args.workbooks:
+        try:
+            if not process_workbook(path, args):
+                failed += 1
+        except Exception as e:
+            _log(f"❌ {path}: {e}")
+            failed += 1
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
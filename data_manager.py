@@ -1,8 +1,15 @@
 import pandas as pd
+import numpy as np
 import shutil
 import os
 import datetime
 from openpyxl import load_workbook
+from preprocess import update_derived_columns, drop_derived_columns
+from ingest import read_table, store_table
+from table_index import TableIndex
+from postal_index import get_postal_index, check_zipcodes, fill_missing_zipcodes
+import save_journal
+import instrumentation
 
 class DataManager:
     REQUIRED_COLUMNS = ["NO.", "名前", "印刷状態", "グループ", "住所"]
@@ -11,27 +18,39 @@ class DataManager:
     def __init__(self):
         self.df = None
         self.file_path = None
+        self.index = None
+        # 郵便番号の確認結果（郵便番号データのCSVが無ければ None）
+        self.zip_check = None
+        # 最後に読み込んだ／保存した時点の表（差分保存の比較元）
+        self.saved_df = None
 
     def load_excel(self, file_object):
         """Excelファイルを読み込み、バリデーションを行う"""
         try:
             # StreamlitのUploadedFileオブジェクトから読み込む
-            self.df = pd.read_excel(file_object, dtype={"NO.": str, "住所": str})
-            
-            # 1. カラムチェック
-            missing_cols = [col for col in self.REQUIRED_COLUMNS if col not in self.df.columns]
-            if missing_cols:
-                return False, f"必須列が不足しています: {', '.join(missing_cols)}"
+            # 同じ内容のファイルを以前読み込んでいれば、検証済みの表がキャッシュから返る
+            with instrumentation.stage("excel.read"):
+                self.df, cache_key, from_cache = read_table(
+                    file_object, profile="data_manager", dtype={"NO.": str, "住所": str}
+                )
+            instrumentation.count("excel.cache_hit" if from_cache else "excel.cache_miss")
+
+            if not from_cache:
+                with instrumentation.stage("excel.validate"):
+                    ok, message = self._validate(self.df)
+                if not ok:
+                    return False, message
+                store_table(self.df, cache_key)
 
-            # 2. NO. 重複チェック
-            if self.df["NO."].duplicated().any():
-                duplicated = self.df[self.df["NO."].duplicated()]["NO."].tolist()
-                return False, f"NO. に重複があります: {duplicated}"
+            self.saved_df = self.df.copy()
 
-            # 3. 印刷状態チェック
-            invalid_status = self.df[~self.df["印刷状態"].isin(self.VALID_STATUS)]
-            if not invalid_status.empty:
-                return False, f"不正な印刷状態が含まれています (行: {invalid_status.index.tolist()})"
+            # 郵便番号・住所の行分け・連名をまとめて前処理しておく
+            self.df = update_derived_columns(self.df)
+            # 絞り込み用のインデックスを作っておく
+            with instrumentation.stage("index.build"):
+                self.index = TableIndex(self.df)
+            # 郵便番号データがあれば、表全体の郵便番号をまとめて確認しておく
+            self.check_zipcodes()
 
             # ファイルパスの保持（保存用、UploadedFileにはname属性がある）
             self.file_path = file_object.name
@@ -40,11 +59,56 @@ class DataManager:
         except Exception as e:
             return False, f"読み込みエラー: {str(e)}"
 
-    def save_excel(self, df_to_save, original_file_path):
-        """データを保存し、バックアップを作成する"""
+    def check_zipcodes(self):
+        """郵便番号を郵便番号データと照らし合わせ、結果を self.zip_check に入れて返す"""
+        index = get_postal_index()
+        self.zip_check = check_zipcodes(self.df, index) if index is not None and self.df is not None else None
+        return self.zip_check
+
+    def fill_zipcodes(self):
+        """郵便番号が未記入の住所に、住所から引いた郵便番号を書き足す。補完した件数を返す"""
+        if self.zip_check is None:
+            return 0
+        df, filled = fill_missing_zipcodes(self.df, self.zip_check)
+        if filled:
+            self.update_data(df)
+            self.check_zipcodes()
+        return filled
+
+    def _validate(self, df):
+        # 1. カラムチェック
+        missing_cols = [col for col in self.REQUIRED_COLUMNS if col not in df.columns]
+        if missing_cols:
+            return False, f"必須列が不足しています: {', '.join(missing_cols)}"
+
+        # 2. NO. 重複チェック
+        if df["NO."].duplicated().any():
+            duplicated = df[df["NO."].duplicated()]["NO."].tolist()
+            return False, f"NO. に重複があります: {duplicated}"
+
+        # 3. 印刷状態チェック
+        invalid_status = df[~df["印刷状態"].isin(self.VALID_STATUS)]
+        if not invalid_status.empty:
+            return False, f"不正な印刷状態が含まれています (行: {invalid_status.index.tolist()})"
+
+        return True, ""
+
+    def save_excel(self, df_to_save, original_file_path, incremental=False):
+        """データを保存し、バックアップを作成する
+
+        incremental=True のときは、読み込み時（前回保存時）から変わったセルだけを
+        書き換え、バックアップの代わりに変更履歴（ジャーナル）へ追記する。
+        行や列の構成が変わっている場合は、通常の保存に切り替える。
+        """
         if original_file_path is None:
             return False, "保存先ファイルが指定されていません。"
 
+        df_to_save = drop_derived_columns(df_to_save)
+        if incremental and self.saved_df is not None and os.path.exists(original_file_path):
+            changes = save_journal.diff_frames(self.saved_df, df_to_save)
+            if changes is not None:
+                return self._save_incremental(df_to_save, original_file_path, changes)
+
         # バックアップ作成
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
         backup_path = f"{os.path.splitext(original_file_path)[0]}_backup_{timestamp}.xlsx"
@@ -54,10 +118,13 @@ class DataManager:
             # ここではローカルアプリ想定で、同名ファイルがカレントにあればバックアップする挙動とする）
             if os.path.exists(original_file_path):
                 shutil.copy(original_file_path, backup_path)
+                # 変更履歴をたどって復元するときのため、丸ごとのバックアップを取ったことも記録する
+                save_journal.append_journal(original_file_path, {"backup": backup_path})
             
             # 保存実行
             # Excelを開いたままだとPermissionErrorになる
             df_to_save.to_excel(original_file_path, index=False)
+            self.saved_df = df_to_save.copy()
             return True, f"保存完了（バックアップ: {backup_path}）"
             
         except PermissionError:
@@ -65,19 +132,55 @@ class DataManager:
         except Exception as e:
             return False, f"保存エラー: {str(e)}"
 
+    def _save_incremental(self, df_to_save, original_file_path, changes):
+        if not changes:
+            return True, "変更はありません"
+        try:
+            save_journal.patch_workbook(original_file_path, changes)
+            save_journal.append_journal(original_file_path, {"changes": changes})
+            self.saved_df = df_to_save.copy()
+            return True, f"保存完了（{len(changes)} セルを更新）"
+        except PermissionError:
+            return False, "ファイルが開かれているため保存できません。Excelを閉じて再試行してください。"
+        except Exception as e:
+            return False, f"保存エラー: {str(e)}"
+
+    def restore_version(self, original_file_path, timestamp):
+        """変更履歴から timestamp 時点の表を復元して返す（ファイルには書き込まない）"""
+        return save_journal.rebuild_version(
+            original_file_path, timestamp,
+            lambda path: pd.read_excel(path, dtype={"NO.": str, "住所": str}),
+        )
+
+    def update_data(self, edited_df):
+        """編集後の表を取り込み、変更のあった行だけ派生列とインデックスを更新する"""
+        if self.df is None or len(edited_df) != len(self.df) or not edited_df.columns.equals(self.df.columns):
+            self.df = update_derived_columns(edited_df)
+            with instrumentation.stage("index.build"):
+                self.index = TableIndex(self.df)
+            return
+
+        edited_df = update_derived_columns(edited_df)
+        cols = [c for c in ["名前", "グループ", "印刷状態"] if c in edited_df.columns]
+        old = self.df[cols].reset_index(drop=True)
+        new = edited_df[cols].reset_index(drop=True)
+        changed = ~((old == new) | (old.isna() & new.isna())).all(axis=1)
+
+        self.df = edited_df
+        self.index.update_rows(self.df, np.flatnonzero(changed.to_numpy()))
+
+    def get_filtered_positions(self, groups, statuses, search_name):
+        """条件に合う行の位置（self.df の行番号の配列）を返す。表のコピーは作らない"""
+        if self.df is None:
+            return np.empty(0, dtype=np.int64)
+        return self.index.filter_positions(groups, statuses, search_name)
+
     def get_filtered_data(self, groups, statuses, search_name):
         """フィルタリングとソートを行う"""
         if self.df is None:
             return pd.DataFrame()
         
-        temp_df = self.df.copy()
-
-        # フィルタ
-        if groups:
-            temp_df = temp_df[temp_df["グループ"].isin(groups)]
-        if statuses:
-            temp_df = temp_df[temp_df["印刷状態"].isin(statuses)]
-        if search_name:
-            temp_df = temp_df[temp_df["名前"].astype(str).str.contains(search_name, na=False)]
-
-        return temp_df
\ No newline at end of file
+        # 該当する行だけを取り出す（全件のコピーは作らない）
+        with instrumentation.stage("filter"):
+            positions = self.get_filtered_positions(groups, statuses, search_name)
+            return self.df.iloc[positions]
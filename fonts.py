@@ -0,0 +1,116 @@
+from functools import partial
+import hashlib
+import operator
+import os
+import pickle
+import threading
+
+# ==========================================
+# 🔲 フォント設定（初めて描画するときに登録する）
+# ==========================================
+# reportlab の読み込みとフォントの登録は、起動時ではなく最初に描画するときまで遅らせる。
+# 筆文字フォントの解析結果（文字幅・文字コード表）はファイルに保存しておき、
+# 別のプロセス（並列描画のワーカーや次回の起動）では解析をやり直さずに読み込む。
+
+CUSTOM_FONT_FILE = "brush.ttf"
+CUSTOM_FONT_NAME = "KakizomeFont"
+FALLBACK_FONT_NAME = "HeiseiMin-W3"
+# 解析済みフォント情報の置き場所
+FONT_CACHE_DIR = os.path.join(".nengajo_cache", "fonts")
+
+_lock = threading.Lock()
+_font_name = None
+
+
+def _identity(x):
+    return x
+
+
+def _metrics_cache_path(path):
+    import reportlab
+    st = os.stat(path)
+    # フォントの差し替えや reportlab の更新があれば別のファイルになる
+    key = f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}|{reportlab.Version}"
+    return os.path.join(FONT_CACHE_DIR, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".pickle")
+
+
+def _restore_ttfont(name, path, cache_path):
+    from weakref import WeakKeyDictionary
+    from reportlab.pdfbase.ttfonts import TTFont, TTFontFace
+
+    with open(cache_path, "rb") as f:
+        font_state, face_state = pickle.load(f)
+
+    face = TTFontFace.__new__(TTFontFace)
+    face.__dict__.update(face_state)
+    # サブセット作成には元のフォントデータが要るので、これだけはファイルから読む
+    with open(path, "rb") as f:
+        face._ttf_data = f.read()
+    # 解析時に作られる単位換算の関数（lambda なので保存できない）を作り直す
+    face._pdfScale = _identity if face.unitsPerEm == 1000 else partial(operator.mul, 1000 / face.unitsPerEm)
+
+    font = TTFont.__new__(TTFont)
+    font.__dict__.update(font_state)
+    font.fontName = name
+    font.face = face
+    font.state = WeakKeyDictionary()
+    return font
+
+
+def _store_ttfont(font, cache_path):
+    face_state = {k: v for k, v in vars(font.face).items() if k not in ("_ttf_data", "_pdfScale")}
+    font_state = {k: v for k, v in vars(font).items() if k not in ("face", "state")}
+    os.makedirs(FONT_CACHE_DIR, exist_ok=True)
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump((font_state, face_state), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cache_path)
+
+
+def load_ttfont(name, path):
+    """TTFont を作る（解析済みの情報があればそれを使い、なければ解析して保存する）"""
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    try:
+        cache_path = _metrics_cache_path(path)
+        if os.path.exists(cache_path):
+            return _restore_ttfont(name, path, cache_path)
+    except Exception:
+        # 保存した情報が読めないときは、普通に解析し直す
+        cache_path = None
+
+    font = TTFont(name, path)
+    if cache_path:
+        try:
+            _store_ttfont(font, cache_path)
+        except Exception:
+            pass
+    return font
+
+
+def _register():
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.cidfonts import UnicodeCIDFont
+
+    try:
+        if os.path.exists(CUSTOM_FONT_FILE):
+            pdfmetrics.registerFont(load_ttfont(CUSTOM_FONT_NAME, CUSTOM_FONT_FILE))
+            return CUSTOM_FONT_NAME
+    except Exception:
+        pass
+    pdfmetrics.registerFont(UnicodeCIDFont(FALLBACK_FONT_NAME))
+    return FALLBACK_FONT_NAME
+
+
+def get_font_name():
+    """描画に使うフォント名を返す（初回の呼び出しでフォントを登録する）"""
+    global _font_name
+    if _font_name is None:
+        with _lock:
+            if _font_name is None:
+                _font_name = _register()
+    return _font_name
+
+
+def is_custom_font():
+    return get_font_name() == CUSTOM_FONT_NAME
@@ -0,0 +1,96 @@
+import hashlib
+import io
+import os
+
+import pandas as pd
+
+# ==========================================
+# 📥 Excel読み込み（高速リーダー＋内容ハッシュ付きキャッシュ）
+# ==========================================
+# 同じExcelを読み直すときは、検証済みの表を列指向ファイル(Parquet)から
+# そのまま読み出す。キャッシュのキーはファイル内容のハッシュなので、
+# 中身が1セルでも変われば別物として読み直される。
+CACHE_DIR = ".nengajo_cache"
+CACHE_MAX_FILES = 20
+# 読み込み処理や検証内容を変えたら上げる（古いキャッシュを使わないため）
+CACHE_VERSION = 1
+
+
+def _read_bytes(file_object):
+    if hasattr(file_object, "getvalue"):
+        return file_object.getvalue()
+    file_object.seek(0)
+    data = file_object.read()
+    file_object.seek(0)
+    return data
+
+
+def read_excel_fast(source, dtype=None):
+    """calamine（Rust製の読み取り専用リーダー）があれば使い、なければ openpyxl で読む"""
+    try:
+        return pd.read_excel(source, dtype=dtype, engine="calamine")
+    except ImportError:
+        if hasattr(source, "seek"):
+            source.seek(0)
+        return pd.read_excel(source, dtype=dtype)
+
+
+def cache_key(data, profile, dtype=None):
+    h = hashlib.sha256()
+    h.update(f"{CACHE_VERSION}:{profile}:{sorted((dtype or {}).items(), key=str)}:".encode())
+    h.update(data)
+    return h.hexdigest()
+
+
+def _cache_path(key):
+    return os.path.join(CACHE_DIR, f"{key}.parquet")
+
+
+def read_table(file_object, profile, dtype=None):
+    """Excelを読み込み (DataFrame, キャッシュキー, キャッシュから読んだか) を返す
+
+    キャッシュから読んだ表は、以前 store_table() した時点で検証済みのもの。
+    """
+    data = _read_bytes(file_object)
+    key = cache_key(data, profile, dtype)
+
+    path = _cache_path(key)
+    if os.path.exists(path):
+        try:
+            df = pd.read_parquet(path)
+            os.utime(path)  # 最近使ったものを残すため更新時刻を新しくする
+            return df, key, True
+        except Exception:
+            # 壊れたキャッシュや pyarrow が無い場合は普通に読み直す
+            pass
+
+    return read_excel_fast(io.BytesIO(data), dtype=dtype), key, False
+
+
+def store_table(df, key):
+    """検証済みの表をキャッシュに保存する（保存できない表は何もしない）"""
+    tmp_path = _cache_path(key) + ".tmp"
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, _cache_path(key))
+    except Exception:
+        # 列に型の混ざった値があるなどで Parquet にできない場合はキャッシュしない
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+    _prune_cache()
+    return True
+
+
+def _prune_cache():
+    try:
+        entries = [
+            os.path.join(CACHE_DIR, name) for name in os.listdir(CACHE_DIR)
+            if name.endswith(".parquet")
+        ]
+        entries.sort(key=os.path.getmtime, reverse=True)
+        for path in entries[CACHE_MAX_FILES:]:
+            os.remove(path)
+    except OSError:
+        pass
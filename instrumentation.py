@@ -0,0 +1,150 @@
+from contextlib import contextmanager
+import cProfile
+import heapq
+import io
+import json
+import os
+import pstats
+import threading
+import time
+
+# ==========================================
+# ⏱️ 処理段階ごとの計測（既定では無効）
+# ==========================================
+# 環境変数 NENGAJO_PROFILE=1 か enable() で有効にする。無効のときは
+# stage() などはほぼ何もしないので、通常の処理速度には影響しない。
+# ※ 並列生成のワーカープロセス内の計測は集計されない（親プロセスの分のみ）。
+
+ENABLED = os.environ.get("NENGAJO_PROFILE") == "1"
+# profiled() で囲んだ処理について cProfile も取るか
+PROFILE = False
+# 段階ごとに残す「遅かったレコード」の件数
+SLOW_OUTLIERS = 10
+
+_lock = threading.Lock()
+_timers = {}     # name -> [回数, 合計秒, 最大秒]
+_counters = {}   # name -> 回数
+_outliers = {}   # name -> [(秒, 識別子), ...] のヒープ（遅い上位のみ）
+_profile_stats = None
+
+
+def enable(flag=True, profile=False):
+    """計測を有効/無効にする。profile=True なら profiled() の区間で cProfile も取る"""
+    global ENABLED, PROFILE
+    ENABLED = flag
+    PROFILE = flag and profile
+
+
+def reset():
+    global _profile_stats
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+        _outliers.clear()
+        _profile_stats = None
+
+
+def add_time(name, seconds, key=None):
+    """name の段階に seconds を加算する。key を渡すと遅いレコードの候補として記録する"""
+    if not ENABLED:
+        return
+    with _lock:
+        timer = _timers.setdefault(name, [0, 0.0, 0.0])
+        timer[0] += 1
+        timer[1] += seconds
+        timer[2] = max(timer[2], seconds)
+        if key is not None:
+            heap = _outliers.setdefault(name, [])
+            item = (seconds, str(key))
+            if len(heap) < SLOW_OUTLIERS:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+
+
+def count(name, n=1):
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+@contextmanager
+def stage(name, key=None):
+    """with stage("pdf.save"): ... のように使い、ブロックの所要時間を記録する"""
+    if not ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(name, time.perf_counter() - start, key)
+
+
+@contextmanager
+def profiled():
+    """ブロック内を cProfile で計測し、結果を累積する（PROFILE が有効なときだけ）
+
+    cProfile は呼び出したスレッドしか計測しないので、Streamlit のように
+    実行ごとにスレッドが変わる場合でも取りこぼさないよう、区間ごとに計測して足し合わせる。
+    """
+    global _profile_stats
+    if not (ENABLED and PROFILE):
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        with _lock:
+            if _profile_stats is None:
+                _profile_stats = pstats.Stats(profiler)
+            else:
+                _profile_stats.add(profiler)
+
+
+def _profile_text(limit=30):
+    if _profile_stats is None:
+        return None
+    out = io.StringIO()
+    _profile_stats.stream = out
+    _profile_stats.sort_stats("cumulative").print_stats(limit)
+    return out.getvalue()
+
+
+def snapshot():
+    """現在の計測結果を dict で返す"""
+    with _lock:
+        stages = {
+            name: {
+                "count": c,
+                "total_sec": total,
+                "mean_ms": total / c * 1000 if c else 0.0,
+                "max_ms": peak * 1000,
+            }
+            for name, (c, total, peak) in sorted(_timers.items(), key=lambda kv: -kv[1][1])
+        }
+        outliers = {
+            name: [{"key": key, "ms": sec * 1000} for sec, key in sorted(heap, reverse=True)]
+            for name, heap in _outliers.items()
+        }
+        counters = dict(_counters)
+    return {
+        "enabled": ENABLED,
+        "stages": stages,
+        "counters": counters,
+        "slow_records": outliers,
+        "profile": _profile_text(),
+    }
+
+
+def export_json(path=None):
+    """計測結果を JSON 文字列で返す（path を渡せばファイルにも書く）"""
+    data = json.dumps(snapshot(), ensure_ascii=False, indent=2)
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(data)
+    return data
@@ -0,0 +1,237 @@
+from collections import namedtuple
+import re
+
+import instrumentation
+
+# ==========================================
+# 📏 単位（reportlab の mm と同じ値。ラスタ描画側で reportlab を読まずに済むようここで定義）
+# ==========================================
+mm = 72.0 / 25.4
+
+# ==========================================
+# 📐 印刷用の位置設定
+# ==========================================
+OFFSET_X = 0.7 * mm
+OFFSET_Y = 1.3 * mm
+
+ZIP_Y = 148.0 * mm - 15.8 * mm
+ZIP_STEP = 7.3 * mm
+ZIP_X_LEFT_START = 46.0 * mm
+ZIP_X_RIGHT_START = ZIP_X_LEFT_START + (3 * ZIP_STEP) + (0.6 * mm)
+ZIP_FONT_SIZE = 14
+
+HAGAKI_WIDTH = 100 * mm
+HAGAKI_HEIGHT = 148 * mm
+
+# 住所の各行 (x, y, 最大フォントサイズ)
+ADDRESS_LINE_CONFIGS = [
+    (90 * mm, 125 * mm, 16),
+    (82 * mm, 118 * mm, 14),
+    (75 * mm, 118 * mm, 14)
+]
+ADDRESS_MAX_HEIGHT = 100 * mm
+
+NAME_SIZE = 30
+NAME_START_Y = 120 * mm
+NAME_MAX_HEIGHT = 95 * mm
+NAME_LINE_SPACING = 1.15
+NAME_CENTER_X = 50 * mm
+NAME_COL_SPACING = 13 * mm
+
+MIN_FONT_SIZE = 8
+
+# 住所の1行あたりの文字数（単語をつなげるときの上限 / 長い単語を切るときの幅）
+ADDRESS_LINE_LIMIT = 17
+ADDRESS_BLOCK_LIMIT = 18
+
+# ==========================================
+# 🧮 前処理済みの派生列（preprocess.py が作る。あればこちらを優先して使う）
+# ==========================================
+ZIP_COLUMN = "_郵便番号"
+ADDRESS_LINES_COLUMN = "_住所行"
+RENMEI_LIST_COLUMN = "_連名リスト"
+# 派生列を計算したときの 住所・連名（編集されたかどうかの判定用）
+ADDRESS_SOURCE_COLUMN = "_住所元"
+RENMEI_SOURCE_COLUMN = "_連名元"
+DERIVED_COLUMNS = [
+    ZIP_COLUMN, ADDRESS_LINES_COLUMN, RENMEI_LIST_COLUMN,
+    ADDRESS_SOURCE_COLUMN, RENMEI_SOURCE_COLUMN,
+]
+
+VERTICAL_TRANS_MAP = str.maketrans({
+    '0': '〇', '1': '一', '2': '二', '3': '三', '4': '四',
+    '5': '五', '6': '六', '7': '七', '8': '八', '9': '九',
+    '-': '丨', 'ー': '丨', '－': '丨', '(': '︵', ')': '︶'
+})
+
+# 1文字分の配置。座標はPDFと同じポイント単位・左下原点で、(x, y) は文字のベースライン中央
+Glyph = namedtuple("Glyph", ["char", "x", "y", "font_size"])
+
+
+# --- 共通関数 ---
+def get_zipcode_digits(address):
+    zipcode = ""
+    zip_match = re.search(r'\d{3}-?\d{4}', address)
+    if zip_match:
+        zipcode = zip_match.group()
+        address = address.replace(zipcode, "").strip()
+    digits = re.sub(r'[^0-9]', '', str(zipcode))
+    return digits, address
+
+def smart_split_address(address):
+    lines = []
+    LIMIT_1 = ADDRESS_LINE_LIMIT
+    LIMIT_2 = ADDRESS_BLOCK_LIMIT
+
+    blocks = re.split(r'[ 　]+', address.strip())
+    current_line = ""
+
+    for block in blocks:
+        if not block: continue
+        if current_line and (len(current_line) + len(block) + 1 <= LIMIT_1):
+            current_line += " " + block
+        else:
+            if current_line:
+                lines.append(current_line)
+            if len(block) > LIMIT_1:
+                while len(block) > LIMIT_2:
+                    lines.append(block[:LIMIT_2])
+                    block = block[LIMIT_2:]
+                current_line = block
+            else:
+                current_line = block
+
+    if current_line:
+        lines.append(current_line)
+
+    return lines[:3]
+
+def split_renmei(renmei):
+    if not renmei:
+        return []
+    # ★★★ 修正ポイント：スペースでの分割を廃止 ★★★
+    # 「・」や「,」や「、」だけで分割します。スペースは名前に残ります。
+    split_items = re.split(r'[,、・]+', renmei)
+    return [x.strip() for x in split_items if x.strip()]
+
+
+# --- レイアウト計算 ---
+def layout_vertical_text(text, x, y_start, max_height, max_font_size, line_spacing=1.1):
+    """縦書き1列分の文字配置を返す（長い文字列は max_height に収まるよう縮小する）"""
+    if not text: return []
+    clean_text = text.translate(VERTICAL_TRANS_MAP)
+    text_len = len(clean_text)
+    if text_len == 0: return []
+
+    calc_size = max_height / (text_len * line_spacing)
+    font_size = max(min(max_font_size, calc_size), MIN_FONT_SIZE)
+
+    glyphs = []
+    current_y = y_start
+    char_step = font_size * line_spacing
+
+    for char in clean_text:
+        glyphs.append(Glyph(char, x, current_y - font_size, font_size))
+        current_y -= char_step
+    return glyphs
+
+def layout_zipcode(digits):
+    if len(digits) < 7:
+        return []
+    y = ZIP_Y + OFFSET_Y
+    glyphs = []
+    for i in range(3):
+        x = ZIP_X_LEFT_START + (i * ZIP_STEP) + OFFSET_X
+        glyphs.append(Glyph(digits[i], x, y, ZIP_FONT_SIZE))
+    for i in range(4):
+        x = ZIP_X_RIGHT_START + (i * ZIP_STEP) + OFFSET_X
+        glyphs.append(Glyph(digits[3+i], x, y, ZIP_FONT_SIZE))
+    return glyphs
+
+class CardRecord:
+    """はがき1枚の描画に使う値だけを持つレコード（辞書より小さく、属性を直接読める）"""
+    __slots__ = ("name", "zip_digits", "address_lines", "renmei_list")
+
+    def __init__(self, name, zip_digits, address_lines, renmei_list):
+        self.name = name
+        self.zip_digits = zip_digits
+        self.address_lines = address_lines
+        self.renmei_list = renmei_list
+
+def card_name(record):
+    if isinstance(record, CardRecord):
+        return record.name
+    return str(record.get("名前", ""))
+
+def _record_text(record, key):
+    text = str(record.get(key, "")).strip()
+    return "" if text.lower() == "nan" else text
+
+def card_fields(record):
+    """レコードから (郵便番号の数字, 住所の行リスト, 連名リスト) を取り出す
+
+    前処理済みの派生列があればそれを使い、なければその場で計算する。
+    """
+    if isinstance(record, CardRecord):
+        return record.zip_digits, list(record.address_lines), list(record.renmei_list)
+
+    digits = record.get(ZIP_COLUMN)
+    if isinstance(digits, str):
+        return digits, list(record[ADDRESS_LINES_COLUMN]), list(record[RENMEI_LIST_COLUMN])
+
+    # 前処理されていないレコード（正規表現をその場で回す）
+    instrumentation.count("layout.inline_parse")
+    full_address = str(record.get("住所", ""))
+    digits, address = get_zipcode_digits(full_address)
+    return digits, smart_split_address(address), split_renmei(_record_text(record, "連名"))
+
+def layout_card(record):
+    """1件分のレコードから、はがき1枚分の文字配置リストを作る"""
+    name = card_name(record)
+    digits, addr_lines, renmei_list = card_fields(record)
+
+    # 1. 郵便番号
+    glyphs = layout_zipcode(digits)
+
+    # 2. 住所
+    for i, line_text in enumerate(addr_lines):
+        if i < len(ADDRESS_LINE_CONFIGS):
+            Lx, Ly, Lsize = ADDRESS_LINE_CONFIGS[i]
+            glyphs += layout_vertical_text(line_text, Lx + OFFSET_X, Ly + OFFSET_Y, ADDRESS_MAX_HEIGHT, Lsize)
+
+    # 3. 名前・連名
+    total_people = 1 + len(renmei_list)
+    start_x = NAME_CENTER_X + ((total_people - 1) * NAME_COL_SPACING / 2) + OFFSET_X
+
+    # 世帯主
+    glyphs += layout_vertical_text(name + " 様", start_x, NAME_START_Y + OFFSET_Y, NAME_MAX_HEIGHT, NAME_SIZE, line_spacing=NAME_LINE_SPACING)
+
+    # 連名
+    current_x = start_x
+    for r_name in renmei_list:
+        current_x -= NAME_COL_SPACING
+        glyphs += layout_vertical_text(r_name + " 様", current_x, NAME_START_Y + OFFSET_Y, NAME_MAX_HEIGHT, NAME_SIZE, line_spacing=NAME_LINE_SPACING)
+
+    return glyphs
+
+def card_chars(record):
+    """layout_card がそのはがきに描く文字の集合"""
+    name = card_name(record)
+    digits, addr_lines, renmei_list = card_fields(record)
+    text = name + " 様" + "".join(addr_lines[:len(ADDRESS_LINE_CONFIGS)]) + "".join(renmei_list)
+    chars = set(text.translate(VERTICAL_TRANS_MAP))
+    if len(digits) >= 7:
+        chars.update(digits[:7])
+    return chars
+
+def layout_signature():
+    """レイアウトに影響する設定値の組（キャッシュのキーに使う）"""
+    return (
+        OFFSET_X, OFFSET_Y,
+        ZIP_Y, ZIP_STEP, ZIP_X_LEFT_START, ZIP_X_RIGHT_START, ZIP_FONT_SIZE,
+        HAGAKI_WIDTH, HAGAKI_HEIGHT,
+        tuple(ADDRESS_LINE_CONFIGS), ADDRESS_MAX_HEIGHT,
+        NAME_SIZE, NAME_START_Y, NAME_MAX_HEIGHT, NAME_LINE_SPACING,
+        NAME_CENTER_X, NAME_COL_SPACING, MIN_FONT_SIZE,
+        ADDRESS_LINE_LIMIT, ADDRESS_BLOCK_LIMIT,
+    )
@@ -0,0 +1,24 @@
+from cache_utils import ByteLRUCache
+
+# ==========================================
+# 📑 1枚ずつのページキャッシュ
+# ==========================================
+# 宛名1件分の文字配置（layout_card の結果）を、内容とレイアウト設定のハッシュをキーにして保持する。
+# 印刷対象を少し切り替えただけなら、新しく増えた・編集された宛名だけレイアウトを計算し、
+# 全ページを1つのキャンバスで描いて1つのPDFにする（フォントを含まないので、筆文字フォントは1つだけ埋め込まれる）。
+PAGE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# これより件数が多いときは、PDF全体をメモリに持たないようキャッシュを使わずストリーミング出力にする
+PAGE_CACHE_MAX_PAGES = 5000
+# Glyph 1つ分のおおよそのメモリ量（namedtuple と中の文字・数値。はがき1枚でおよそ40文字）
+GLYPH_BYTES = 180
+
+
+def glyphs_sizeof(glyphs):
+    return GLYPH_BYTES * len(glyphs) + 64
+
+
+class PageCache(ByteLRUCache):
+    """キー → 1ページ分の文字配置（Glyph のタプル）のLRUキャッシュ（メモリ量の目安の上限で追い出す）"""
+
+    def __init__(self, max_bytes=PAGE_CACHE_MAX_BYTES):
+        super().__init__(max_bytes, sizeof=glyphs_sizeof)
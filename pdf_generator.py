@@ -1,215 +1,519 @@
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import mm
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.pdfbase.cidfonts import UnicodeCIDFont
-from PIL import Image
+import hashlib
 import io
-import re
+import json
+import multiprocessing
 import os
-import fitz  # PyMuPDF
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache, partial
+from itertools import islice
+from preview_cache import PreviewCache, get_background
+from layout import (
+    HAGAKI_WIDTH, HAGAKI_HEIGHT,
+    get_zipcode_digits, smart_split_address,
+    card_fields, card_name, card_chars, layout_card, layout_vertical_text, layout_signature as _layout_signature,
+)
+from records import RecordBatch
+from pdf_stream import StreamingPdfWriter
+import instrumentation
+from fonts import CUSTOM_FONT_FILE, get_font_name, is_custom_font
+
+# ※ reportlab・PyMuPDF・Pillow は読み込みに時間がかかるので、使う関数の中で import する。
+#   フォントの登録も get_font_name() を最初に呼んだときに行う（起動を速くするため）。
 
 # ==========================================
-# 🔲 フォント設定
+# 📺 プレビュー画面専用の調整
 # ==========================================
-CUSTOM_FONT_FILE = "brush.ttf"
-FONT_NAME = "KakizomeFont"
+PREVIEW_ADJUST_X_MM = 0.0
+PREVIEW_ADJUST_Y_MM = -4.0
 
 # ==========================================
-# 📐 印刷用の位置設定
+# ⚡ 並列生成の設定
 # ==========================================
-OFFSET_X = 0.7 * mm 
-OFFSET_Y = 1.3 * mm 
-
-ZIP_Y = 148.0 * mm - 15.8 * mm 
-ZIP_STEP = 7.3 * mm 
-ZIP_X_LEFT_START = 46.0 * mm 
-ZIP_X_RIGHT_START = ZIP_X_LEFT_START + (3 * ZIP_STEP) + (0.6 * mm)
+# これ未満の件数ではプロセス起動のコストの方が大きいので直列で描画する
+PARALLEL_MIN_RECORDS = 200
+# 1ワーカーあたりのチャンク数（偏りをならすため少し細かめに分割する）
+CHUNKS_PER_WORKER = 4
+# ワーカーは fork ではなく spawn で起動する。Streamlit のサーバーはスレッドを使うので、
+# fork すると親のスレッドが持っていたロックを子が引き継いで止まることがある
+# （spawn の起動コストは、フォント情報のキャッシュで小さくしてある）
+MP_START_METHOD = "spawn"
 
-HAGAKI_WIDTH = 100 * mm
-HAGAKI_HEIGHT = 148 * mm
+# ==========================================
+# 🌊 ストリーミング出力の設定
+# ==========================================
+# 1度に描画する件数。メモリ使用量はこの件数分でほぼ頭打ちになる
+STREAM_CHUNK_SIZE = 500
 
 # ==========================================
-# 📺 プレビュー画面専用の調整
+# 🖼️ 一覧表示（サムネイル）の設定
 # ==========================================
-PREVIEW_ADJUST_X_MM = 0.0
-PREVIEW_ADJUST_Y_MM = -4.0
+# 一覧に並べる縮小版の解像度（はがき1枚がおよそ 190×280 ピクセルになる）
+THUMBNAIL_DPI = 48
+# これ未満の枚数ならプロセスを起こさずにその場で描画する
+PARALLEL_MIN_PREVIEWS = 8
 
 # ==========================================
 
-# フォント登録
-try:
-    if os.path.exists(CUSTOM_FONT_FILE):
-        pdfmetrics.registerFont(TTFont(FONT_NAME, CUSTOM_FONT_FILE))
-    else:
-        pdfmetrics.registerFont(UnicodeCIDFont("HeiseiMin-W3"))
-        FONT_NAME = "HeiseiMin-W3"
-except:
-    pdfmetrics.registerFont(UnicodeCIDFont("HeiseiMin-W3"))
-    FONT_NAME = "HeiseiMin-W3"
-
-
-# --- 共通関数 ---
-def get_zipcode_digits(address):
-    zipcode = ""
-    zip_match = re.search(r'\d{3}-?\d{4}', address)
-    if zip_match:
-        zipcode = zip_match.group()
-        address = address.replace(zipcode, "").strip()
-    digits = re.sub(r'[^0-9]', '', str(zipcode))
-    return digits, address
-
-def smart_split_address(address):
-    lines = []
-    LIMIT_1 = 17
-    LIMIT_2 = 18
-    
-    blocks = re.split(r'[ 　]+', address.strip())
-    current_line = ""
-    
-    for block in blocks:
-        if not block: continue
-        if current_line and (len(current_line) + len(block) + 1 <= LIMIT_1):
-            current_line += " " + block
-        else:
-            if current_line:
-                lines.append(current_line)
-            if len(block) > LIMIT_1:
-                while len(block) > LIMIT_2:
-                    lines.append(block[:LIMIT_2])
-                    block = block[LIMIT_2:]
-                current_line = block
-            else:
-                current_line = block
-    
-    if current_line:
-        lines.append(current_line)
-    
-    return lines[:3]
+def new_process_pool(workers):
+    """描画用のプロセスプールを作る（アプリでは1つ作って使い回す）"""
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(MP_START_METHOD))
+
+def is_pool_broken(pool):
+    """ワーカーが異常終了して使えなくなったプールかどうか（以後の submit はすべて BrokenProcessPool になる）"""
+    return bool(getattr(pool, "_broken", False))
+
+@contextmanager
+def _process_pool(workers, executor=None):
+    # executor が渡されればそれを使い（閉じるのは持ち主）、無ければその場で作って最後に閉じる
+    if executor is not None:
+        yield executor
+        return
+    pool = new_process_pool(workers)
+    try:
+        yield pool
+    finally:
+        # 中断されたときに、まだ始まっていない描画を待たずに終われるようにする
+        pool.shutdown(wait=True, cancel_futures=True)
+
+def _cancel_all(futures):
+    # 共有のプールは閉じられないので、投入した描画のうち始まっていないものだけ取り消す
+    for future in futures:
+        future.cancel()
 
 # --- PDF描画クラス ---
+@lru_cache(maxsize=8192)
+def _glyph_width(char, font_name, font_size):
+    from reportlab.pdfbase import pdfmetrics
+    return pdfmetrics.stringWidth(char, font_name, font_size)
+
+def draw_glyphs(c, glyphs, font_name):
+    """layout の文字配置をPDFキャンバスに描画する
+
+    1文字ごとに drawCentredString すると、文字ごとに BT〜ET とフォント指定・絶対座標が
+    書き出されてファイルが大きくなる。ここではページ全体を1つのテキストオブジェクトにまとめ、
+    フォントはサイズが変わるときだけ指定し、文字の位置は直前の文字からの相対移動（Td）で書く。
+    縦書きは同じ送り幅の移動が続くので、圧縮もよく効く。
+    """
+    if not glyphs:
+        return
+    text = c.beginText()
+    current_size = None
+    prev = None
+    for g in glyphs:
+        if g.font_size != current_size:
+            text.setFont(font_name, g.font_size)
+            current_size = g.font_size
+        x = g.x - _glyph_width(g.char, font_name, g.font_size) / 2
+        if prev is None:
+            text.setTextOrigin(x, g.y)
+        else:
+            # moveCursor は y を下向きに取るので符号を反転して渡す
+            text.moveCursor(x - prev[0], prev[1] - g.y)
+        prev = (x, g.y)
+        text.textOut(g.char)
+    c.drawText(text)
+
 class VerticalTextRendererPDF:
     def __init__(self, canvas_obj, font_name):
         self.c = canvas_obj
         self.font_name = font_name
-        self.trans_map = str.maketrans({
-            '0': '〇', '1': '一', '2': '二', '3': '三', '4': '四',
-            '5': '五', '6': '六', '7': '七', '8': '八', '9': '九',
-            '-': '丨', 'ー': '丨', '－': '丨', '(': '︵', ')': '︶'
-        })
 
     def draw_text(self, text, x, y_start, max_height, max_font_size, line_spacing=1.1):
-        if not text: return
-        clean_text = text.translate(self.trans_map)
-        text_len = len(clean_text)
-        if text_len == 0: return
-        
-        calc_size = max_height / (text_len * line_spacing)
-        font_size = max(min(max_font_size, calc_size), 8)
-        
-        self.c.setFont(self.font_name, font_size)
-        current_y = y_start
-        char_step = font_size * line_spacing
-        
-        for char in clean_text:
-            self.c.drawCentredString(x, current_y - font_size, char)
-            current_y -= char_step
-
-def generate_nengajo_pdf(target_records):
-    buffer = io.BytesIO()
-    c = canvas.Canvas(buffer, pagesize=(HAGAKI_WIDTH, HAGAKI_HEIGHT))
-    renderer = VerticalTextRendererPDF(c, FONT_NAME)
-    
+        glyphs = layout_vertical_text(text, x, y_start, max_height, max_font_size, line_spacing)
+        draw_glyphs(self.c, glyphs, self.font_name)
+
+def job_charset(records):
+    """印刷対象全体で描きうる文字を、決まった順に並べた文字列を返す（標準フォントなら空文字）
+
+    チャンクやページを別々のキャンバスで描くとき、どのキャンバスでもこの文字列で
+    先にフォントの文字の割り当てを済ませておくと、埋め込まれる筆文字フォントの
+    サブセットがすべて同じ中身になり、結合・書き出しのときに1つにまとめられる。
+    """
+    if not is_custom_font():
+        return ""
+    chars = set()
+    for record in records:
+        chars |= card_chars(record)
+    return "".join(sorted(chars))
+
+def _prime_font(c, charset):
+    # 描く順ではなく charset の順で、文字をサブセットの番号に割り当てておく
+    if not charset:
+        return
+    from reportlab.pdfbase import pdfmetrics
+    font = pdfmetrics.getFont(get_font_name())
+    if getattr(font, "_dynamicFont", False):
+        font.splitString(charset, c._doc)
+
+def _draw_pages(c, target_records):
+    font_name = get_font_name()
     for record in target_records:
-        name = str(record.get("名前", ""))
-        full_address = str(record.get("住所", ""))
-        
-        renmei = str(record.get("連名", "")).strip()
-        if renmei.lower() == "nan": renmei = ""
-
-        digits, address = get_zipcode_digits(full_address)
-
-        # 1. 郵便番号
-        if len(digits) >= 7:
-            c.setFont(FONT_NAME, 14) 
-            for i in range(3):
-                x = ZIP_X_LEFT_START + (i * ZIP_STEP) + OFFSET_X
-                y = ZIP_Y + OFFSET_Y
-                c.drawCentredString(x, y, digits[i])
-            for i in range(4):
-                x = ZIP_X_RIGHT_START + (i * ZIP_STEP) + OFFSET_X
-                y = ZIP_Y + OFFSET_Y
-                c.drawCentredString(x, y, digits[3+i])
-
-        # 2. 住所
-        addr_lines = smart_split_address(address)
-        line_configs = [
-            (90 * mm, 125 * mm, 16),
-            (82 * mm, 118 * mm, 14),
-            (75 * mm, 118 * mm, 14)
-        ]
-        for i, line_text in enumerate(addr_lines):
-            if i < len(line_configs):
-                Lx, Ly, Lsize = line_configs[i]
-                renderer.draw_text(line_text, Lx + OFFSET_X, Ly + OFFSET_Y, 100 * mm, Lsize)
-
-        # 3. 名前・連名
-        renmei_list = []
-        if renmei:
-            # ★★★ 修正ポイント：スペースでの分割を廃止 ★★★
-            # 「・」や「,」や「、」だけで分割します。スペースは名前に残ります。
-            split_items = re.split(r'[,、・]+', renmei)
-            renmei_list = [x.strip() for x in split_items if x.strip()]
-
-        total_people = 1 + len(renmei_list)
-        col_spacing = 13 * mm
-        start_x = (50 * mm) + ((total_people - 1) * col_spacing / 2) + OFFSET_X
-        
-        NAME_SIZE = 30 
-        NAME_START_Y = 120 * mm 
-        
-        # 世帯主
-        renderer.draw_text(name + " 様", start_x, NAME_START_Y + OFFSET_Y, 95 * mm, NAME_SIZE, line_spacing=1.15)
-        
-        # 連名
-        current_x = start_x
-        for r_name in renmei_list:
-            current_x -= col_spacing
-            renderer.draw_text(r_name + " 様", current_x, NAME_START_Y + OFFSET_Y, 95 * mm, NAME_SIZE, line_spacing=1.15)
-        
+        with instrumentation.stage("pdf.record", key=card_name(record) if instrumentation.ENABLED else None):
+            with instrumentation.stage("layout.card"):
+                glyphs = layout_card(record)
+            with instrumentation.stage("pdf.draw_glyphs"):
+                draw_glyphs(c, glyphs, font_name)
+            c.showPage()
+        instrumentation.count("pdf.pages")
+
+def _draw_glyph_pages(c, glyph_pages, progress=None):
+    # 文字配置（layout_card の結果）から1枚ずつ描く。progress(描いた枚数) を毎ページ呼ぶ
+    font_name = get_font_name()
+    for n, glyphs in enumerate(glyph_pages, 1):
+        with instrumentation.stage("pdf.draw_glyphs"):
+            draw_glyphs(c, glyphs, font_name)
         c.showPage()
+        instrumentation.count("pdf.pages")
+        if progress:
+            progress(n)
 
-    c.save()
-    buffer.seek(0)
-    return buffer
+def _new_canvas(buffer, charset):
+    from reportlab.pdfgen import canvas
 
-def generate_preview_image(name, full_address, renmei=""):
-    temp_record = [{"名前": name, "住所": full_address, "連名": renmei}]
-    pdf_bytes = generate_nengajo_pdf(temp_record)
-    
-    doc = fitz.open(stream=pdf_bytes.getvalue(), filetype="pdf")
-    page = doc.load_page(0)
-    dpi = 300
-    pix = page.get_pixmap(dpi=dpi, alpha=True)
-    pdf_img = Image.frombytes("RGBA", [pix.width, pix.height], pix.samples)
-    
-    bg_filename = "hagaki.png"
-    base_img = Image.new("RGBA", pdf_img.size, (255, 255, 255, 255))
-
-    if os.path.exists(bg_filename):
+    c = canvas.Canvas(buffer, pagesize=(HAGAKI_WIDTH, HAGAKI_HEIGHT))
+    _prime_font(c, charset)
+    return c
+
+def _render_pdf_bytes(target_records, charset=""):
+    """レコード群を1つのPDFとして描画し、バイト列で返す（ワーカープロセスからも呼ばれる）
+
+    charset は job_charset の結果。同じ charset で描いたPDFどうしは、埋め込みフォントが同じ中身になる。
+    """
+    buffer = io.BytesIO()
+    c = _new_canvas(buffer, charset)
+    _draw_pages(c, target_records)
+    with instrumentation.stage("pdf.save"):
+        c.save()
+    return buffer.getvalue()
+
+def _render_glyph_pages(glyph_pages, charset="", progress=None):
+    """文字配置のリスト（1枚分ずつ）を1つのPDFとして描画し、バイト列で返す（ワーカープロセスからも呼ばれる）"""
+    buffer = io.BytesIO()
+    c = _new_canvas(buffer, charset)
+    _draw_glyph_pages(c, glyph_pages, progress)
+    with instrumentation.stage("pdf.save"):
+        c.save()
+    return buffer.getvalue()
+
+def _report_size(n_bytes, pages):
+    """出力サイズを計測結果に残す（1枚あたりの大きさを追えるように）"""
+    instrumentation.count("pdf.output_bytes", n_bytes)
+    instrumentation.count("pdf.output_pages", pages)
+
+def bytes_per_page(n_bytes, pages):
+    return n_bytes / pages if pages else 0.0
+
+def _split_chunks(records, chunk_size):
+    return [records[i:i + chunk_size] for i in range(0, len(records), chunk_size)]
+
+def _compact_bytes(doc):
+    if not is_custom_font():
+        # 標準フォントは埋め込まれないので、不要なオブジェクトを掃除するだけでよい
+        return doc.tobytes(garbage=3, deflate=True)
+    # 同じ charset で描いた結合元どうしは筆文字フォントのサブセットが同じ中身なので、
+    # garbage=4 で重複オブジェクトとして1つにまとめる
+    # （doc.subset_fonts() はサブセット済みのフォントを飛ばすので、ここでは何もしない）
+    return doc.tobytes(garbage=4, deflate=True)
+
+def merge_pdf_parts(pdf_parts):
+    """PDFのバイト列を順番どおりに1つの文書へ結合する"""
+    import fitz  # PyMuPDF
+
+    merged = fitz.open()
+    for part_bytes in pdf_parts:
+        with instrumentation.stage("pdf.merge"):
+            with fitz.open(stream=part_bytes, filetype="pdf") as part:
+                merged.insert_pdf(part)
+    with instrumentation.stage("pdf.merge"):
+        data = _compact_bytes(merged)
+    merged.close()
+    return data
+
+def generate_nengajo_pdf(target_records, workers=1, chunk_size=None, executor=None):
+    """宛名面のPDFを生成する
+
+    workers が2以上かつ件数が PARALLEL_MIN_RECORDS 以上のときは、
+    レコードをチャンクに分けてプロセスプールで描画し、元の順番で結合する。
+    RecordBatch を渡すと、チャンクは配列のスライスのままワーカーへ送られる。
+    executor を渡すと、プールを作らずにそれを使う（new_process_pool で作ったもの）。
+    """
+    records = target_records if isinstance(target_records, RecordBatch) else list(target_records)
+    workers = max(1, workers or os.cpu_count() or 1)
+    # 直列でも同じ割り当てで描き、並列・ストリーミングと同じフォントのサブセットにする
+    charset = job_charset(records)
+
+    if workers == 1 or len(records) < PARALLEL_MIN_RECORDS:
+        pdf_data = _render_pdf_bytes(records, charset)
+        _report_size(len(pdf_data), len(records))
+        return io.BytesIO(pdf_data)
+
+    if not chunk_size:
+        chunk_size = -(-len(records) // (workers * CHUNKS_PER_WORKER))
+    chunks = _split_chunks(records, chunk_size)
+
+    # executor.map は投入順に結果を返すので、ページ順は直列生成と同じになる。
+    # どのチャンクも同じ charset で描くので、埋め込みフォントは結合時に1つにまとまる
+    with _process_pool(min(workers, len(chunks)), executor) as pool:
+        pdf_data = merge_pdf_parts(pool.map(partial(_render_pdf_bytes, charset=charset), chunks))
+
+    _report_size(len(pdf_data), len(records))
+    return io.BytesIO(pdf_data)
+
+def page_cache_key(record):
+    """宛名1件分のページを表すキー（描画に使う内容とレイアウト設定のハッシュ）"""
+    digits, addr_lines, renmei_list = card_fields(record)
+    payload = [card_name(record), digits, addr_lines, renmei_list, layout_signature()]
+    return hashlib.sha1(json.dumps(payload, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def generate_nengajo_pdf_cached(target_records, page_cache, workers=1, progress=None, executor=None):
+    """ページキャッシュを使ってPDFを生成する
+
+    キャッシュには1枚ごとの文字配置（layout_card の結果）を持つ。キャッシュに無い
+    （新しい・編集された）宛名だけレイアウトを計算し、全ページを1つのキャンバスで描く
+    （並列のときは同じ charset で描いたチャンクを結合する）ので、筆文字フォントは1つだけ埋め込まれる。
+    progress を渡すと、描画が進むたびに progress(済んだページ数, 全ページ数) を呼ぶ
+    （例外を投げれば処理を中断できる）。
+    """
+    records = list(target_records)
+    glyph_pages = []
+    layouts = {}
+    hits = 0
+    for record in records:
+        key = page_cache_key(record)
+        glyphs = layouts.get(key)
+        if glyphs is None:
+            glyphs = page_cache.get(key)
+            if glyphs is None:
+                with instrumentation.stage("layout.card"):
+                    glyphs = tuple(layout_card(record))
+                page_cache.put(key, glyphs)
+            else:
+                hits += 1
+            layouts[key] = glyphs
+        glyph_pages.append(glyphs)
+    instrumentation.count("pdf.page_cache_hit", hits)
+    instrumentation.count("pdf.page_cache_miss", len(layouts) - hits)
+
+    total = len(glyph_pages)
+    charset = "".join(sorted({g.char for glyphs in layouts.values() for g in glyphs})) if is_custom_font() else ""
+    workers = max(1, workers or os.cpu_count() or 1)
+    if progress:
+        progress(0, total)
+
+    if workers == 1 or total < PARALLEL_MIN_RECORDS:
+        page_progress = (lambda n: progress(n, total)) if progress else None
+        pdf_data = _render_glyph_pages(glyph_pages, charset, page_progress)
+    else:
+        chunk_size = -(-total // (workers * CHUNKS_PER_WORKER))
+        chunks = _split_chunks(glyph_pages, chunk_size)
+        with _process_pool(min(workers, len(chunks)), executor) as pool:
+            futures = [pool.submit(_render_glyph_pages, chunk, charset) for chunk in chunks]
+            parts = []
+            done = 0
+            try:
+                for chunk, future in zip(chunks, futures):
+                    parts.append(future.result())
+                    done += len(chunk)
+                    if progress:
+                        progress(done, total)
+            finally:
+                _cancel_all(futures)
+        pdf_data = merge_pdf_parts(parts)
+
+    _report_size(len(pdf_data), total)
+    return io.BytesIO(pdf_data)
+
+def _iter_chunks(records, chunk_size):
+    if isinstance(records, RecordBatch):
+        yield from records.chunks(chunk_size)
+        return
+    iterator = iter(records)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+def _iter_rendered_chunks(records, chunk_size, workers, executor=None):
+    """チャンクごとのPDFを元の順番で返す（並列時も先読みは workers*2 チャンクまで）
+
+    全件を先に見渡せる（RecordBatch やリストの）ときは、どのチャンクも同じ文字の割り当てで描くので、
+    StreamingPdfWriter が筆文字フォントを1つにまとめられる。イテレータのときはチャンクごとに埋め込まれる。
+    """
+    charset = job_charset(records) if isinstance(records, (RecordBatch, list, tuple)) else ""
+    chunks = _iter_chunks(records, chunk_size)
+    if workers == 1:
+        for chunk in chunks:
+            yield _render_pdf_bytes(chunk, charset)
+        return
+
+    with _process_pool(workers, executor) as pool:
+        pending = deque()
         try:
-            user_bg = Image.open(bg_filename).convert("RGBA")
-            user_bg = user_bg.resize(pdf_img.size, Image.Resampling.LANCZOS)
-            base_img = Image.alpha_composite(base_img, user_bg)
-        except:
-            pass
+            for chunk in chunks:
+                pending.append(pool.submit(_render_pdf_bytes, chunk, charset))
+                if len(pending) >= workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # 途中で打ち切られたときは、先読みしたチャンクの描画を待たずに終える
+            _cancel_all(pending)
+
+class _ChunkSink:
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(data)
+
+    def drain(self):
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+def stream_nengajo_pdf(target_records, chunk_size=STREAM_CHUNK_SIZE, workers=1, executor=None):
+    """PDFをバイト列の断片として順に返すジェネレータ
+
+    target_records はイテレータでよく、chunk_size 件ずつ取り出して描画する。
+    """
+    workers = max(1, workers or os.cpu_count() or 1)
+    sink = _ChunkSink()
+    writer = StreamingPdfWriter(sink, (HAGAKI_WIDTH, HAGAKI_HEIGHT))
+    for pdf_bytes in _iter_rendered_chunks(target_records, chunk_size, workers, executor):
+        with instrumentation.stage("pdf.stream_append"):
+            writer.append_pdf(pdf_bytes)
+        yield sink.drain()
+    writer.close()
+    _report_size(writer.position, writer.page_count)
+    yield sink.drain()
+
+def write_nengajo_pdf(target_records, output, chunk_size=STREAM_CHUNK_SIZE, workers=1, progress=None, executor=None):
+    """PDFをファイル（パスまたは書き込み可能なファイルオブジェクト）へ書き出し、ページ数を返す
+
+    progress を渡すと、チャンクを書き出すたびに progress(済んだページ数, None) を呼ぶ
+    （全体の件数はイテレータからは分からないので None。例外を投げれば処理を中断できる）。
+    """
+    if isinstance(output, (str, os.PathLike)):
+        with open(output, "wb") as f:
+            return write_nengajo_pdf(target_records, f, chunk_size, workers, progress, executor)
 
-    px_scale = dpi / 25.4
-    shift_x = int(PREVIEW_ADJUST_X_MM * px_scale)
-    shift_y = int(PREVIEW_ADJUST_Y_MM * px_scale)
+    workers = max(1, workers or os.cpu_count() or 1)
+    writer = StreamingPdfWriter(output, (HAGAKI_WIDTH, HAGAKI_HEIGHT))
+    chunks = _iter_rendered_chunks(target_records, chunk_size, workers, executor)
+    try:
+        for pdf_bytes in chunks:
+            with instrumentation.stage("pdf.stream_append"):
+                writer.append_pdf(pdf_bytes)
+            if progress:
+                progress(writer.page_count, None)
+    finally:
+        chunks.close()
+    writer.close()
+    _report_size(writer.position, writer.page_count)
+    return writer.page_count
 
-    shifted_layer = Image.new("RGBA", base_img.size, (0, 0, 0, 0))
-    shifted_layer.paste(pdf_img, (shift_x, -shift_y), mask=pdf_img) 
+def layout_signature():
+    """レイアウトに影響する設定値の組（キャッシュのキーに使う）"""
+    return (get_font_name(), PREVIEW_ADJUST_X_MM, PREVIEW_ADJUST_Y_MM) + _layout_signature()
 
-    combined = Image.alpha_composite(base_img, shifted_layer)
-    return combined.convert("RGB")
\ No newline at end of file
+_preview_cache = PreviewCache()
+
+def _rasterize_via_pdf(name, full_address, renmei, dpi):
+    import fitz  # PyMuPDF
+    from PIL import Image
+
+    temp_record = [{"名前": name, "住所": full_address, "連名": renmei}]
+    pdf_bytes = _render_pdf_bytes(temp_record)
+
+    with instrumentation.stage("preview.fitz_rasterize"):
+        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        page = doc.load_page(0)
+        pix = page.get_pixmap(dpi=dpi, alpha=True)
+        pdf_img = Image.frombytes("RGBA", [pix.width, pix.height], pix.samples)
+        doc.close()
+    return pdf_img
+
+def _preview_key(name, full_address, renmei, dpi):
+    return (name, full_address, renmei, layout_signature(), dpi)
+
+def _render_preview(name, full_address, renmei, dpi):
+    """プレビュー画像を描画する（キャッシュを使わない。ワーカープロセスからも呼ばれる）"""
+    from PIL import Image
+    import raster_renderer
+
+    if is_custom_font():
+        # 筆文字フォントが使えるときは、PDFを作らずに直接ラスタ描画する
+        glyphs = layout_card({"名前": name, "住所": full_address, "連名": renmei})
+        with instrumentation.stage("preview.raster"):
+            text_layer = raster_renderer.render_glyphs(glyphs, CUSTOM_FONT_FILE, dpi)
+    else:
+        # 標準フォント(CIDフォント)はPillowで扱えないので、PDF経由でラスタ化する
+        text_layer = _rasterize_via_pdf(name, full_address, renmei, dpi)
+
+    with instrumentation.stage("preview.composite"):
+        base_img = get_background(text_layer.size)
+
+        px_scale = dpi / 25.4
+        shift_x = int(PREVIEW_ADJUST_X_MM * px_scale)
+        shift_y = int(PREVIEW_ADJUST_Y_MM * px_scale)
+
+        shifted_layer = Image.new("RGBA", base_img.size, (0, 0, 0, 0))
+        shifted_layer.paste(text_layer, (shift_x, -shift_y), mask=text_layer) 
+
+        combined = Image.alpha_composite(base_img, shifted_layer).convert("RGB")
+    return combined
+
+def generate_preview_image(name, full_address, renmei="", dpi=300):
+    """プレビュー画像を返す（同じ内容・設定の2回目以降はキャッシュから返す）
+
+    返り値はキャッシュと共有されるので、呼び出し側で書き換えないこと。
+    """
+    cache_key = _preview_key(name, full_address, renmei, dpi)
+    cached = _preview_cache.get(cache_key)
+    if cached is not None:
+        instrumentation.count("preview.cache_hit")
+        return cached
+    instrumentation.count("preview.cache_miss")
+
+    combined = _render_preview(name, full_address, renmei, dpi)
+    _preview_cache.put(cache_key, combined)
+    return combined
+
+def iter_preview_images(items, dpi=THUMBNAIL_DPI, workers=1, executor=None):
+    """(名前, 住所, 連名) の並びのプレビュー画像を作り、(位置, 画像) をできた順に返すジェネレータ
+
+    キャッシュにあるものを先に返し、残りは workers 個のプロセスで手分けして描画する。
+    途中で読むのをやめた（close された）ときは、まだ始まっていない描画は取り消す。
+    """
+    items = list(items)
+    missing = []
+    for i, (name, full_address, renmei) in enumerate(items):
+        cached = _preview_cache.get(_preview_key(name, full_address, renmei, dpi))
+        if cached is not None:
+            instrumentation.count("preview.cache_hit")
+            yield i, cached
+        else:
+            missing.append(i)
+    instrumentation.count("preview.cache_miss", len(missing))
+
+    workers = max(1, workers or os.cpu_count() or 1)
+    if workers == 1 or len(missing) < PARALLEL_MIN_PREVIEWS:
+        for i in missing:
+            img = _render_preview(*items[i], dpi)
+            _preview_cache.put(_preview_key(*items[i], dpi), img)
+            yield i, img
+        return
+
+    with _process_pool(min(workers, len(missing)), executor) as pool:
+        futures = {pool.submit(_render_preview, *items[i], dpi): i for i in missing}
+        try:
+            for future in as_completed(futures):
+                i = futures[future]
+                img = future.result()
+                _preview_cache.put(_preview_key(*items[i], dpi), img)
+                yield i, img
+        finally:
+            _cancel_all(futures)
@@ -0,0 +1,169 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+import pandas as pd
+
+from pdf_generator import (
+    write_nengajo_pdf, generate_nengajo_pdf_cached, layout_signature, bytes_per_page,
+)
+from records import RecordBatch
+from page_cache import PAGE_CACHE_MAX_PAGES
+import instrumentation
+
+# ==========================================
+# 🏃 PDF生成のバックグラウンドジョブ
+# ==========================================
+# 画面の処理を止めずに裏でPDFを作り、進み具合・残り時間の目安・中断を扱う。
+# ジョブは印刷対象の内容のハッシュをキーに持つので、画面を再実行しても
+# 同じ内容なら作成中／作成済みのジョブをそのまま使う。
+
+RUNNING = "running"
+DONE = "done"
+CANCELLED = "cancelled"
+ERROR = "error"
+# 作成済みのPDFを残しておく件数（古いものから一時ファイルごと消す）
+MAX_FINISHED_JOBS = 5
+# ストリーミング出力のときの1チャンクの件数（進み具合の更新間隔になる）
+JOB_CHUNK_SIZE = 100
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def job_key(target_df):
+    """印刷対象の内容とレイアウト設定から、ジョブのキーを作る"""
+    cols = [c for c in ["名前", "住所", "連名"] if c in target_df.columns]
+    h = hashlib.sha1(repr(layout_signature()).encode("utf-8"))
+    h.update(pd.util.hash_pandas_object(target_df[cols].astype(str), index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+class PdfJob:
+    def __init__(self, key, total):
+        self.key = key
+        self.total = total
+        self.done = 0
+        self.status = RUNNING
+        self.error = None
+        self.result_path = None
+        self.size_bytes = 0
+        self.started = time.monotonic()
+        self.finished = None
+        self.cancel_event = threading.Event()
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def fraction(self):
+        return min(1.0, self.done / self.total) if self.total else 1.0
+
+    def eta_seconds(self):
+        """残り時間の目安（秒）。まだ見積もれないときは None"""
+        if self.status != RUNNING or self.done == 0:
+            return None
+        return self.elapsed / self.done * max(0, self.total - self.done)
+
+    @property
+    def bytes_per_page(self):
+        return bytes_per_page(self.size_bytes, self.total)
+
+    def _progress(self, done, total):
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+        self.done = done
+        if total:
+            self.total = total
+
+    def _cleanup(self):
+        if self.result_path and os.path.exists(self.result_path):
+            os.remove(self.result_path)
+        self.result_path = None
+
+
+class PdfJobManager:
+    def __init__(self, page_cache=None, workers=None, max_jobs=1, executor=None):
+        self.page_cache = page_cache
+        self.workers = workers or os.cpu_count()
+        # 描画用のプロセスプール、またはそれを返す関数（None ならジョブごとに作る）。
+        # 関数ならジョブを始めるたびに呼ぶので、ワーカーが落ちてプールが壊れても次のジョブは新しいプールで動く
+        self.executor = executor
+        self._executor = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix="pdf-job")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            return self._jobs.get(key)
+
+    def submit(self, key, target_df):
+        """ジョブを開始する。同じキーで作成中・作成済みのジョブがあればそれを返す"""
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and job.status in (RUNNING, DONE):
+                return job
+            job = PdfJob(key, len(target_df))
+            self._jobs[key] = job
+            self._jobs.move_to_end(key)
+        # 描画に使う列だけを配列で持たせて渡す（画面側は編集のたびに表を作り直し、
+        # 元の表を書き換えないので、作った時点の内容のまま描画される）
+        self._executor.submit(self._run, job, RecordBatch.from_frame(target_df))
+        self._prune()
+        return job
+
+    def cancel(self, key):
+        job = self.get(key)
+        if job is not None and job.status == RUNNING:
+            job.cancel_event.set()
+
+    def _run(self, job, batch):
+        fd, path = tempfile.mkstemp(suffix=".pdf", prefix="nengajo_")
+        os.close(fd)
+        job.result_path = path
+        try:
+            with instrumentation.stage("pdf.total"):
+                self._write(job, batch, path)
+            job.size_bytes = os.path.getsize(path)
+            job.done = job.total
+            job.status = DONE
+        except JobCancelled:
+            job.status = CANCELLED
+            job._cleanup()
+        except Exception as e:
+            job.status = ERROR
+            job.error = str(e)
+            job._cleanup()
+        finally:
+            job.finished = time.monotonic()
+
+    def _pool(self):
+        return self.executor() if callable(self.executor) else self.executor
+
+    def _write(self, job, batch, path):
+        executor = self._pool()
+        if self.page_cache is not None and job.total <= PAGE_CACHE_MAX_PAGES:
+            # 前回から変わった宛名だけを描画し、残りはキャッシュ済みのページを使う
+            pdf_data = generate_nengajo_pdf_cached(
+                batch, self.page_cache, workers=self.workers, progress=job._progress, executor=executor
+            )
+            with open(path, "wb") as f:
+                f.write(pdf_data.getbuffer())
+        else:
+            # ページ数が多くてもメモリが増えないよう、ファイルへ少しずつ書き出す
+            write_nengajo_pdf(
+                batch, path,
+                chunk_size=JOB_CHUNK_SIZE, workers=self.workers, progress=job._progress, executor=executor
+            )
+
+    def _prune(self):
+        with self._lock:
+            finished = [k for k, j in self._jobs.items() if j.status != RUNNING]
+            for key in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+                self._jobs.pop(key)._cleanup()
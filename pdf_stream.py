@@ -0,0 +1,149 @@
+import hashlib
+import re
+
+# ==========================================
+# 🌊 ストリーミングPDF書き出し
+# ==========================================
+# チャンクごとに描画した小さなPDFを、オブジェクト番号を振り直しながら
+# 出力先へ順に書き足していく。手元に残すのはオブジェクトの位置とページ番号の
+# 整数リストだけなので、ページ数が増えてもメモリはほぼ一定のまま。
+# ページ以外のオブジェクト（埋め込みフォント・文字幅・リソース辞書など）は、
+# 前のチャンクと中身が同じなら書き出さずに前のものを参照する。すべてのチャンクを
+# 同じ文字の割り当てで描画しておけば、筆文字フォントのサブセットは文書全体で1つになる。
+
+_CATALOG_OBJ = 1
+_PAGES_OBJ = 2
+_REF_PATTERN = re.compile(r"(\d+) 0 R")
+# /Length だけに一致させる（埋め込みフォントの /Length1 /Length2 などは書き換えない）
+_LENGTH_PATTERN = re.compile(r"/Length\b\s*\d+(?: 0 R)?")
+
+
+class StreamingPdfWriter:
+    """複数のPDFを1つの文書として、先頭から順に書き出すライター
+
+    sink は write(bytes) を持つオブジェクト（ファイルなど）。
+    """
+
+    def __init__(self, sink, page_size):
+        self.sink = sink
+        self.page_size = page_size
+        self.position = 0
+        # offsets[n] = オブジェクト n の書き出し位置（0番はPDFの決まりで未使用）
+        self.offsets = [0, None, None]
+        self.page_refs = []
+        # 中身のハッシュ → 書き出し済みのオブジェクト番号（ページ以外の共有できるものだけ）
+        self._shared = {}
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _write(self, data):
+        self.sink.write(data)
+        self.position += len(data)
+
+    def _write_object(self, obj_num, source, stream=None):
+        self.offsets[obj_num] = self.position
+        data = f"{obj_num} 0 obj\n{source}\n".encode("latin-1")
+        if stream is not None:
+            data += b"stream\n" + stream + b"\nendstream\n"
+        self._write(data + b"endobj\n")
+
+    @property
+    def page_count(self):
+        return len(self.page_refs)
+
+    def append_pdf(self, pdf_bytes):
+        """1つのPDFの全ページを文書の末尾に追加する"""
+        import fitz  # PyMuPDF
+
+        with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+            # カタログ・ページツリー・文書情報は出力側でまとめて作るので写さない
+            skipped = {doc.pdf_catalog()}
+            info = doc.xref_get_key(-1, "Info")
+            if info[0] == "xref":
+                skipped.add(int(info[1].split()[0]))
+            pages_nodes = {
+                xref for xref in range(1, doc.xref_length())
+                if doc.xref_get_key(xref, "Type") == ("name", "/Pages")
+            }
+
+            # ページとその内容はページごとに違うので、共有を探さずにそのまま書く
+            per_page = set()
+            for page in doc:
+                per_page.add(page.xref)
+                per_page.update(page.get_contents())
+
+            mapping = {xref: _PAGES_OBJ for xref in pages_nodes}
+            for xref in range(1, doc.xref_length()):
+                if xref not in mapping and xref not in skipped:
+                    self._copy_object(doc, xref, mapping, skipped, per_page, set())
+
+            for page in doc:
+                self.page_refs.append(mapping[page.xref])
+
+    def _copy_object(self, doc, xref, mapping, skipped, per_page, visiting):
+        """オブジェクトを参照先から順に書き出し、出力側の番号を返す"""
+        if xref in mapping:
+            return mapping[xref]
+        if xref in skipped or xref >= doc.xref_length():
+            return None
+
+        source = doc.xref_object(xref, compressed=True)
+        visiting.add(xref)
+        for match in _REF_PATTERN.finditer(source):
+            ref = int(match.group(1))
+            if ref in visiting:
+                # 循環参照の相手は先に番号だけ決めておく（中身での共有はしない）
+                if ref not in mapping:
+                    mapping[ref] = self._new_number()
+            else:
+                self._copy_object(doc, ref, mapping, skipped, per_page, visiting)
+        visiting.discard(xref)
+
+        def renumber(match):
+            new_num = mapping.get(int(match.group(1)))
+            return f"{new_num} 0 R" if new_num else "null"
+
+        stream = None
+        if doc.xref_is_stream(xref):
+            stream = doc.xref_stream_raw(xref)
+            source = _LENGTH_PATTERN.sub(f"/Length {len(stream)}", source)
+        source = _REF_PATTERN.sub(renumber, source)
+
+        if xref in mapping:
+            new_num = mapping[xref]
+        else:
+            digest = None
+            if xref not in per_page:
+                digest = hashlib.sha1(source.encode("latin-1") + b"\0" + (stream or b"")).digest()
+                if digest in self._shared:
+                    mapping[xref] = self._shared[digest]
+                    return mapping[xref]
+            new_num = mapping[xref] = self._new_number()
+            if digest is not None:
+                self._shared[digest] = new_num
+        self._write_object(new_num, source, stream)
+        return new_num
+
+    def _new_number(self):
+        self.offsets.append(None)
+        return len(self.offsets) - 1
+
+    def close(self):
+        """ページツリー・カタログ・相互参照表を書いて文書を閉じる"""
+        width, height = self.page_size
+        kids = " ".join(f"{ref} 0 R" for ref in self.page_refs)
+        self._write_object(
+            _PAGES_OBJ,
+            f"<</Type/Pages/Count {len(self.page_refs)}/Kids[{kids}]"
+            f"/MediaBox[0 0 {width:.4f} {height:.4f}]>>",
+        )
+        self._write_object(_CATALOG_OBJ, f"<</Type/Catalog/Pages {_PAGES_OBJ} 0 R>>")
+
+        xref_position = self.position
+        lines = [f"xref\n0 {len(self.offsets)}\n", "0000000000 65535 f\r\n"]
+        for offset in self.offsets[1:]:
+            lines.append(f"{offset:010d} 00000 n\r\n")
+        lines.append(
+            f"trailer\n<</Size {len(self.offsets)}/Root {_CATALOG_OBJ} 0 R>>\n"
+            f"startxref\n{xref_position}\n%%EOF\n"
+        )
+        self._write("".join(lines).encode("latin-1"))
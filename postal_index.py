@@ -0,0 +1,275 @@
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+import pandas as pd
+
+from ingest import CACHE_DIR
+from layout import ZIP_COLUMN
+from preprocess import split_zipcode, to_text
+import instrumentation
+
+# ==========================================
+# 📮 郵便番号の索引（日本郵便の KEN_ALL.CSV から作る）
+# ==========================================
+# 郵便番号データのCSVを置いておくと、初回だけ読み込んで numpy 配列（.npy）に変換し、
+# 以降はメモリマップで開く（全体を読み込まないので起動が速く、メモリもほぼ使わない）。
+# 郵便番号 → 都道府県・市区町村・町域 と、住所の先頭 → 郵便番号 の両方向を
+# 表全体に対してまとめて引ける。
+
+# 探すCSVのファイル名（Shift_JIS 版・UTF-8 版のどちらでもよい）
+POSTAL_CSV_FILES = ["KEN_ALL.CSV", "utf_ken_all.csv"]
+POSTAL_INDEX_DIR = os.path.join(CACHE_DIR, "postal")
+POSTAL_INDEX_VERSION = 1
+
+# KEN_ALL.CSV の列番号（ヘッダーなし）
+_CSV_ZIP, _CSV_PREF, _CSV_CITY, _CSV_TOWN = 2, 6, 7, 8
+# 町域として扱わない決まり文句
+_TOWN_PLACEHOLDERS = ["以下に掲載がない場合", "の次に番地がくる場合", "一円"]
+
+# 確認結果の列と値
+ZIP_STATUS_COLUMN = "郵便番号チェック"
+ZIP_SUGGEST_COLUMN = "候補の郵便番号"
+ZIP_OK = "OK"
+ZIP_MISSING = "未記入"
+ZIP_UNKNOWN = "該当なし"
+ZIP_MISMATCH = "住所と不一致"
+
+
+def _read_postal_csv(path):
+    for encoding in ("utf-8", "cp932"):
+        try:
+            return pd.read_csv(
+                path, header=None, dtype=str, encoding=encoding, keep_default_na=False,
+                usecols=[_CSV_ZIP, _CSV_PREF, _CSV_CITY, _CSV_TOWN],
+            )
+        except UnicodeDecodeError:
+            continue
+    raise ValueError(f"{path} の文字コードが読み取れません")
+
+
+def _normalize_rows(raw):
+    town = raw[_CSV_TOWN]
+    # 町域が長いと「（」〜「）」が複数行に分かれるので、括弧の途中の行は捨てる
+    depth = (town.str.count("（") - town.str.count("）")).cumsum().shift(fill_value=0)
+    rows = raw[depth <= 0]
+    town = rows[_CSV_TOWN].str.replace(r"（.*$", "", regex=True)
+    for placeholder in _TOWN_PLACEHOLDERS:
+        town = town.mask(town.str.endswith(placeholder), "")
+    table = pd.DataFrame({
+        "zip": rows[_CSV_ZIP].str.strip().astype(np.uint32),
+        "pref": rows[_CSV_PREF].str.strip(),
+        "city": rows[_CSV_CITY].str.strip(),
+        "town": town.str.strip(),
+    })
+    return table.drop_duplicates().reset_index(drop=True)
+
+
+def _sorted_keys(keys, zips):
+    """住所の文字列 → 郵便番号の表を作る（同じ住所に複数の番号があるものは 0 = 決められない）"""
+    table = pd.DataFrame({"key": keys, "zip": zips}).drop_duplicates()
+    ambiguous = table["key"].duplicated(keep=False)
+    table.loc[ambiguous, "zip"] = 0
+    table = table.drop_duplicates("key").sort_values("key")
+    return table["key"].to_numpy(dtype=str), table["zip"].to_numpy(dtype=np.uint32)
+
+
+def build_postal_index(csv_path, index_dir=POSTAL_INDEX_DIR):
+    """CSVから索引の .npy ファイル群を作る"""
+    table = _normalize_rows(_read_postal_csv(csv_path)).sort_values("zip", kind="stable")
+    arrays = {
+        "zip": table["zip"].to_numpy(dtype=np.uint32),
+        "pref": table["pref"].to_numpy(dtype=str),
+        "city": table["city"].to_numpy(dtype=str),
+        "town": table["town"].to_numpy(dtype=str),
+    }
+    # 都道府県から書いた住所用と、都道府県を省いた住所用の2通り
+    arrays["addr_key"], arrays["addr_zip"] = _sorted_keys(table["pref"] + table["city"] + table["town"], table["zip"])
+    arrays["local_key"], arrays["local_zip"] = _sorted_keys(table["city"] + table["town"], table["zip"])
+
+    tmp_dir = index_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_dir, name + ".npy"), array)
+    with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(_source_meta(csv_path), f)
+    shutil.rmtree(index_dir, ignore_errors=True)
+    os.replace(tmp_dir, index_dir)
+
+
+def _source_meta(csv_path):
+    st = os.stat(csv_path)
+    return {"version": POSTAL_INDEX_VERSION, "path": os.path.abspath(csv_path), "size": st.st_size, "mtime": st.st_mtime}
+
+
+def _fixed_width(values, width):
+    # 比較用に固定長の文字列配列にする（長い分は切り捨て。先頭一致を調べるだけなので十分）
+    return np.asarray(values, dtype=str).astype(f"<U{width}")
+
+
+def _longest_prefix(keys, queries):
+    """queries それぞれについて、先頭が一致する最も長い keys の位置を返す（なければ -1）
+
+    keys は並べ替え済み。二分探索した直前のキーが先頭一致でなければ、
+    共通部分の長さまで問い合わせを縮めて探し直す（問い合わせは毎回短くなるので必ず終わる）。
+    """
+    width = keys.dtype.itemsize // 4
+    key_codes = keys.view(np.uint32).reshape(len(keys), width)
+    query_codes = _fixed_width(queries, width).view(np.uint32).reshape(len(queries), width).copy()
+    result = np.full(len(queries), -1, dtype=np.int64)
+    active = np.flatnonzero(query_codes[:, 0] != 0)
+    positions = np.arange(width)
+
+    while active.size:
+        current = query_codes[active]
+        idx = np.searchsorted(keys, current.view(f"<U{width}").ravel(), side="right") - 1
+        found = idx >= 0
+        active, current, idx = active[found], current[found], idx[found]
+
+        candidate = key_codes[idx]
+        differs = candidate != current
+        common = np.where(differs.any(axis=1), differs.argmax(axis=1), width)
+        key_len = (candidate != 0).sum(axis=1)
+        is_prefix = common >= key_len
+        result[active[is_prefix]] = idx[is_prefix]
+
+        retry = ~is_prefix & (common > 0)
+        active, current, common = active[retry], current[retry], common[retry]
+        query_codes[active] = np.where(positions >= common[:, None], 0, current)
+    return result
+
+
+class PostalIndex:
+    """メモリマップで開いた郵便番号の索引"""
+
+    def __init__(self, index_dir=POSTAL_INDEX_DIR):
+        def load(name):
+            return np.load(os.path.join(index_dir, name + ".npy"), mmap_mode="r")
+
+        self.zip = load("zip")
+        self.pref = load("pref")
+        self.city = load("city")
+        self.town = load("town")
+        self.addr_key = load("addr_key")
+        self.addr_zip = load("addr_zip")
+        self.local_key = load("local_key")
+        self.local_zip = load("local_zip")
+
+    def __len__(self):
+        return len(self.zip)
+
+    def _zip_rows(self, digits):
+        text = pd.Series(digits, dtype=object).fillna("").astype(str)
+        valid = text.str.fullmatch(r"\d{7}").to_numpy(dtype=bool)
+        codes = pd.to_numeric(text.where(valid, "0")).to_numpy(dtype=np.uint32)
+        pos = np.searchsorted(self.zip, codes)
+        pos_clipped = np.minimum(pos, len(self.zip) - 1)
+        hit = valid & (pos < len(self.zip)) & (self.zip[pos_clipped] == codes)
+        return np.where(hit, pos_clipped, -1)
+
+    def lookup_zip(self, digits):
+        """7桁の郵便番号（文字列）の並び → 都道府県・市区町村・町域の DataFrame（該当なしは空文字）"""
+        rows = self._zip_rows(list(digits))
+        hit = rows >= 0
+        out = {}
+        for col, array in (("都道府県", self.pref), ("市区町村", self.city), ("町域", self.town)):
+            values = np.full(len(rows), "", dtype=object)
+            values[hit] = array[rows[hit]]
+            out[col] = values
+        return pd.DataFrame(out)
+
+    def lookup_address(self, addresses):
+        """住所（郵便番号を除いた部分）の並び → 7桁の郵便番号の配列（決められないものは空文字）"""
+        queries = pd.Series(list(addresses), dtype=object).fillna("").astype(str)
+        queries = queries.str.replace(r"[\s　]+", "", regex=True).to_numpy()
+        codes = np.zeros(len(queries), dtype=np.uint32)
+
+        hit = _longest_prefix(self.addr_key, queries)
+        codes[hit >= 0] = self.addr_zip[hit[hit >= 0]]
+        # 都道府県を省いて書かれた住所は、市区町村からの表で探す
+        rest = np.flatnonzero(hit < 0)
+        if rest.size:
+            local = _longest_prefix(self.local_key, queries[rest])
+            codes[rest[local >= 0]] = self.local_zip[local[local >= 0]]
+        return np.where(codes > 0, np.char.zfill(codes.astype(str), 7), "").astype(object)
+
+
+def find_postal_csv():
+    for name in POSTAL_CSV_FILES:
+        if os.path.exists(name):
+            return name
+    return None
+
+
+_index_lock = threading.Lock()
+_index_cache = {}
+
+
+def get_postal_index():
+    """郵便番号の索引を返す（CSVが無ければ None。CSVが更新されていれば作り直す）"""
+    csv_path = find_postal_csv()
+    if csv_path is None:
+        return None
+    meta = _source_meta(csv_path)
+    with _index_lock:
+        cached = _index_cache.get("index")
+        if cached is not None and _index_cache.get("meta") == meta:
+            return cached
+        try:
+            with open(os.path.join(POSTAL_INDEX_DIR, "meta.json"), encoding="utf-8") as f:
+                stale = json.load(f) != meta
+        except (OSError, ValueError):
+            stale = True
+        if stale:
+            with instrumentation.stage("postal.build"):
+                build_postal_index(csv_path)
+        index = PostalIndex()
+        _index_cache.update(index=index, meta=meta)
+        return index
+
+
+def check_zipcodes(df, index):
+    """表全体の郵便番号を索引と照らし合わせ、確認結果と候補の郵便番号の DataFrame を返す
+
+    ・未記入: 住所に郵便番号が無い
+    ・該当なし: 索引に無い郵便番号
+    ・住所と不一致: 郵便番号の市区町村と住所の書き出しが合わない
+    候補の郵便番号は、住所の先頭から引いたもの（決められなければ空文字）。
+    """
+    with instrumentation.stage("postal.check"):
+        address = to_text(df["住所"]).mask(df["住所"].isna(), "")
+        digits = df[ZIP_COLUMN].fillna("").astype(str)
+        rest = split_zipcode(address)[1].str.replace(r"[\s　]+", "", regex=True)
+
+        found = index.lookup_zip(digits.to_numpy())
+        found.index = df.index
+        # 行ごとに違う文字列との先頭一致なので、numpy の要素ごとの比較を使う
+        text = rest.to_numpy(dtype=str)
+        pref_city = (found["都道府県"] + found["市区町村"]).to_numpy(dtype=str)
+        city = found["市区町村"].to_numpy(dtype=str)
+        matches = (pref_city != "") & (np.char.startswith(text, pref_city) | np.char.startswith(text, city))
+
+        status = pd.Series(ZIP_OK, index=df.index, dtype=object)
+        status[~matches] = ZIP_MISMATCH
+        status[(digits != "") & (found["市区町村"] == "")] = ZIP_UNKNOWN
+        status[digits == ""] = ZIP_MISSING
+
+        suggest = pd.Series("", index=df.index, dtype=object)
+        need = (status != ZIP_OK).to_numpy()
+        if need.any():
+            suggest[need] = index.lookup_address(rest[need])
+        return pd.DataFrame({ZIP_STATUS_COLUMN: status, ZIP_SUGGEST_COLUMN: suggest}, index=df.index)
+
+
+def fill_missing_zipcodes(df, check):
+    """郵便番号が未記入で候補が見つかった行について、住所の先頭に郵便番号を書き足した表を返す"""
+    target = (check[ZIP_STATUS_COLUMN] == ZIP_MISSING) & (check[ZIP_SUGGEST_COLUMN] != "")
+    if not target.any():
+        return df, 0
+    df = df.copy()
+    zipcode = check.loc[target, ZIP_SUGGEST_COLUMN]
+    df.loc[target, "住所"] = zipcode.str[:3] + "-" + zipcode.str[3:] + " " + to_text(df.loc[target, "住所"])
+    return df, int(target.sum())
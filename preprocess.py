@@ -0,0 +1,133 @@
+import re
+
+import pandas as pd
+
+import instrumentation
+
+from layout import (
+    ZIP_COLUMN, ADDRESS_LINES_COLUMN, RENMEI_LIST_COLUMN,
+    ADDRESS_SOURCE_COLUMN, RENMEI_SOURCE_COLUMN, DERIVED_COLUMNS,
+    ADDRESS_LINE_LIMIT, get_zipcode_digits, smart_split_address, split_renmei,
+)
+
+# ==========================================
+# 🧮 読み込み時の前処理（郵便番号・住所の行分け・連名の分割）
+# ==========================================
+# 描画のたびに1件ずつ正規表現を回さなくて済むよう、表全体に対して
+# まとめて計算し、"_" で始まる派生列として DataFrame に持たせておく。
+
+ZIP_PATTERN = r'\d{3}-?\d{4}'
+
+
+def to_text(series):
+    """列を文字列の列にする（str() と同じく欠損値は "nan"。pandas のバージョンによらず揃える）"""
+    return series.astype(str).fillna("nan")
+
+
+def _has_wide_digits(text):
+    # 全角数字など ASCII 以外の数字を含むか（get_zipcode_digits の \d はこれにも一致する）
+    try:
+        # pyarrow の文字列型（RE2）は \d が ASCII の数字にしか一致しないので、文字の分類で調べる
+        return text.str.contains(r'[^\P{Nd}0-9]', regex=True)
+    except re.error:
+        # object 型（Python の re）は \P{..} が使えない
+        return text.str.contains(r'(?![0-9])\d', regex=True)
+
+
+def split_zipcode(address):
+    """住所の列から、郵便番号の数字と郵便番号を除いた住所の列を作る（get_zipcode_digits と同じ結果）"""
+    zipcode = address.str.extract(f"({ZIP_PATTERN})", expand=False)
+    digits = zipcode.str.replace(r'[^0-9]', "", regex=True).fillna("")
+    rest = address.str.replace(ZIP_PATTERN, "", n=1, regex=True).str.strip()
+
+    # 郵便番号らしき数字が2つ以上ある行と、ASCII 以外の数字を含む行は
+    # 正規表現の実装によって結果が変わりうるので、元の関数で1件ずつ処理する
+    fallback = (address.str.count(ZIP_PATTERN) > 1) | _has_wide_digits(address)
+    if fallback.any():
+        results = address[fallback].map(get_zipcode_digits)
+        digits[fallback] = results.str[0]
+        rest[fallback] = results.str[1]
+    return digits, rest
+
+
+def _address_lines(rest):
+    # 空白をまとめたうえで1行に収まる住所は、そのまま1行とする
+    normalized = rest.str.strip().str.replace(r'[ 　]+', ' ', regex=True)
+    lines = pd.Series([[]] * len(rest), index=rest.index, dtype=object)
+
+    short = (normalized.str.len() <= ADDRESS_LINE_LIMIT) & (normalized != "")
+    lines[short] = normalized[short].map(lambda text: [text])
+
+    # 折り返しが必要な住所だけ、行分けのルールを1件ずつ適用する
+    long = ~short & (normalized != "")
+    if long.any():
+        lines[long] = rest[long].map(smart_split_address)
+    return lines
+
+
+def _renmei_lists(renmei):
+    # 結果が行ごとのリストなので、split・explode・groupby で組み直すより1行ずつ split_renmei を呼ぶ方が速い
+    return renmei.map(split_renmei).astype(object)
+
+
+def _compute(df):
+    address = to_text(df["住所"]) if "住所" in df.columns else pd.Series("nan", index=df.index)
+    if "連名" in df.columns:
+        renmei = to_text(df["連名"]).str.strip()
+        renmei = renmei.mask(renmei.str.lower() == "nan", "")
+    else:
+        renmei = pd.Series("", index=df.index)
+
+    digits, rest = split_zipcode(address)
+    return pd.DataFrame({
+        ZIP_COLUMN: digits,
+        ADDRESS_LINES_COLUMN: _address_lines(rest),
+        RENMEI_LIST_COLUMN: _renmei_lists(renmei),
+        ADDRESS_SOURCE_COLUMN: address,
+        RENMEI_SOURCE_COLUMN: renmei,
+    }, index=df.index)
+
+
+def _stale_rows(df):
+    if any(col not in df.columns for col in DERIVED_COLUMNS):
+        return pd.Series(True, index=df.index)
+    address = to_text(df["住所"]) if "住所" in df.columns else "nan"
+    stale = df[ADDRESS_SOURCE_COLUMN].ne(address) | df[ZIP_COLUMN].isna()
+    if "連名" in df.columns:
+        renmei = to_text(df["連名"]).str.strip()
+        renmei = renmei.mask(renmei.str.lower() == "nan", "")
+        stale |= df[RENMEI_SOURCE_COLUMN].ne(renmei)
+    return stale
+
+
+def update_derived_columns(df):
+    """派生列を付けた DataFrame を返す
+
+    派生列がまだ無ければ全行を計算し、既にあれば 住所・連名 が
+    変わった行（st.data_editor で編集された行など）だけを計算し直す。
+    """
+    stale = _stale_rows(df)
+    if not stale.any():
+        return df
+
+    instrumentation.count("preprocess.rows", int(stale.sum()))
+    with instrumentation.stage("preprocess.derived"):
+        return _apply_derived(df.copy(), stale)
+
+
+def _apply_derived(df, stale):
+    if stale.all():
+        derived = _compute(df)
+        for col in DERIVED_COLUMNS:
+            df[col] = derived[col]
+    else:
+        derived = _compute(df.loc[stale])
+        for col in DERIVED_COLUMNS:
+            df[col] = df[col].astype(object)
+            df.loc[stale, col] = derived[col]
+    return df
+
+
+def drop_derived_columns(df):
+    """保存用に派生列を取り除く"""
+    return df.drop(columns=DERIVED_COLUMNS, errors="ignore")
@@ -0,0 +1,54 @@
+from functools import lru_cache
+import os
+
+from cache_utils import ByteLRUCache
+
+# ==========================================
+# 🗂️ プレビュー用キャッシュ設定
+# ==========================================
+BG_FILENAME = "hagaki.png"
+# 完成プレビューを保持するメモリ上限（300dpiのはがき1枚でおよそ6MB）
+PREVIEW_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+
+def _image_nbytes(img):
+    return img.width * img.height * len(img.getbands())
+
+
+def _bg_mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+@lru_cache(maxsize=8)
+def _load_background(size, path, mtime):
+    from PIL import Image
+
+    base_img = Image.new("RGBA", size, (255, 255, 255, 255))
+    if mtime is None:
+        return base_img
+    try:
+        user_bg = Image.open(path).convert("RGBA")
+        user_bg = user_bg.resize(size, Image.Resampling.LANCZOS)
+        base_img = Image.alpha_composite(base_img, user_bg)
+    except Exception:
+        pass
+    return base_img
+
+
+def get_background(size, path=BG_FILENAME):
+    """白地に背景画像を合成したものを返す（サイズごとに1回だけデコード・リサイズする）
+
+    返り値はキャッシュ共有なので、呼び出し側で書き換えないこと。
+    背景画像が差し替えられた場合は更新時刻が変わるので作り直される。
+    """
+    return _load_background(tuple(size), path, _bg_mtime(path))
+
+
+class PreviewCache(ByteLRUCache):
+    """完成済みプレビュー画像のLRUキャッシュ（メモリ量の上限で追い出す）"""
+
+    def __init__(self, max_bytes=PREVIEW_CACHE_MAX_BYTES):
+        super().__init__(max_bytes, sizeof=_image_nbytes)
@@ -0,0 +1,44 @@
+from functools import lru_cache
+import math
+
+from PIL import Image, ImageDraw, ImageFont
+
+from layout import HAGAKI_WIDTH, HAGAKI_HEIGHT
+
+PT_PER_INCH = 72.0
+
+
+@lru_cache(maxsize=64)
+def _load_font(font_path, size_px):
+    return ImageFont.truetype(font_path, size_px)
+
+
+def _font_size_px(font_size, scale):
+    # PDFと同じ端数のある大きさで描く（整数に丸めると文字が太り、印刷の仕上がりとずれる）。
+    # FreeType は 1/64 ピクセル単位で扱うので、そこまで丸めてもフォントのキャッシュが効く
+    return max(1 / 64, round(font_size * scale * 64) / 64)
+
+
+def page_size_px(dpi):
+    """はがき1枚のピクセルサイズ（PyMuPDF の get_pixmap と同じく切り上げ）"""
+    scale = dpi / PT_PER_INCH
+    return math.ceil(HAGAKI_WIDTH * scale), math.ceil(HAGAKI_HEIGHT * scale)
+
+
+def render_glyphs(glyphs, font_path, dpi=300):
+    """layout の文字配置を透明背景のRGBA画像に直接描画する（PDFを経由しない）"""
+    scale = dpi / PT_PER_INCH
+    img = Image.new("RGBA", page_size_px(dpi), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+
+    for g in glyphs:
+        if g.char.isspace():
+            continue
+        font = _load_font(font_path, _font_size_px(g.font_size, scale))
+        # PDFは左下原点、画像は左上原点なので y を反転する。
+        # drawCentredString と同じく、x は文字の中央・y はベースライン
+        px = g.x * scale
+        py = (HAGAKI_HEIGHT - g.y) * scale
+        draw.text((px, py), g.char, font=font, fill=(0, 0, 0, 255), anchor="ms")
+
+    return img
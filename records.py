@@ -0,0 +1,79 @@
+from layout import (
+    CardRecord, card_fields, card_name,
+    ZIP_COLUMN, ADDRESS_LINES_COLUMN, RENMEI_LIST_COLUMN, DERIVED_COLUMNS,
+)
+
+# ==========================================
+# 🗃️ 描画用のレコードの束
+# ==========================================
+# to_dict(orient="records") のように1行ずつ全列入りの辞書を作るのではなく、
+# 描画に使う4項目（名前・郵便番号の数字・住所の行・連名）だけを列ごとの配列で持つ。
+# 派生列は DataFrame の列をそのまま参照し（object 型の列はコピーされない）、
+# チャンクに分けるときも配列のスライス（ビュー）を渡すだけで済む。
+
+
+class RecordBatch:
+    """描画に使う列だけを配列で持つレコードの束（len・スライス・反復ができる）"""
+    __slots__ = ("names", "zip_digits", "address_lines", "renmei_lists")
+
+    def __init__(self, names, zip_digits, address_lines, renmei_lists):
+        self.names = names
+        self.zip_digits = zip_digits
+        self.address_lines = address_lines
+        self.renmei_lists = renmei_lists
+
+    @classmethod
+    def from_frame(cls, df):
+        """DataFrame から作る（派生列が無ければ先に表全体でまとめて前処理する）"""
+        from preprocess import update_derived_columns, to_text
+
+        if any(col not in df.columns for col in DERIVED_COLUMNS):
+            df = update_derived_columns(df)
+        # 名前は str() と同じく欠損値を "nan" とする（ページキャッシュのキーを変えないため）
+        return cls(
+            to_text(df["名前"]).to_numpy(dtype=object),
+            df[ZIP_COLUMN].to_numpy(dtype=object),
+            df[ADDRESS_LINES_COLUMN].to_numpy(dtype=object),
+            df[RENMEI_LIST_COLUMN].to_numpy(dtype=object),
+        )
+
+    @classmethod
+    def from_records(cls, records):
+        """辞書のレコードの並びから作る（前処理されていない辞書はここで1件ずつ計算する）"""
+        import numpy as np
+
+        names, digits, lines, renmei = [], [], [], []
+        for record in records:
+            d, a, r = card_fields(record)
+            names.append(card_name(record))
+            digits.append(d)
+            lines.append(a)
+            renmei.append(r)
+
+        def column(values):
+            # リストの要素がリストでも2次元配列にならないよう、1つずつ入れる
+            array = np.empty(len(values), dtype=object)
+            for i, value in enumerate(values):
+                array[i] = value
+            return array
+
+        return cls(column(names), column(digits), column(lines), column(renmei))
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return RecordBatch(
+                self.names[key], self.zip_digits[key], self.address_lines[key], self.renmei_lists[key]
+            )
+        return CardRecord(self.names[key], self.zip_digits[key], self.address_lines[key], self.renmei_lists[key])
+
+    def __iter__(self):
+        for row in zip(self.names, self.zip_digits, self.address_lines, self.renmei_lists):
+            yield CardRecord(*row)
+
+    def chunks(self, chunk_size):
+        """chunk_size 件ずつのスライスを順に返す"""
+        for start in range(0, len(self), chunk_size):
+            yield self[start:start + chunk_size]
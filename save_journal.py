@@ -0,0 +1,112 @@
+import datetime
+import json
+import math
+import os
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+
+# ==========================================
+# 📝 差分保存と変更履歴（ジャーナル）
+# ==========================================
+# 保存のたびにファイル全体をコピーする代わりに、変更したセルの
+# 「NO.・列名・変更前・変更後」だけを1行のJSONとして追記していく。
+# 現在のファイルからこの履歴を新しい順に巻き戻せば、過去の任意の版を復元できる。
+
+KEY_COLUMN = "NO."
+
+
+def journal_path(original_file_path):
+    return f"{os.path.splitext(original_file_path)[0]}_journal.jsonl"
+
+
+def _plain(value):
+    """セル・JSONに書ける素のPythonの値にする（欠損値は None）"""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is None or (isinstance(value, float) and math.isnan(value)) or value is pd.NaT:
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    return value
+
+
+def diff_frames(old_df, new_df):
+    """同じ行・列構成の2つの表を比べ、変わったセルの一覧を返す
+
+    構成が違う（行の追加・削除・並べ替え、列の増減がある）場合は None を返す。
+    """
+    if KEY_COLUMN not in new_df.columns or list(old_df.columns) != list(new_df.columns):
+        return None
+    old = old_df.reset_index(drop=True)
+    new = new_df.reset_index(drop=True)
+    if len(old) != len(new) or not old[KEY_COLUMN].astype(str).equals(new[KEY_COLUMN].astype(str)):
+        return None
+
+    changes = []
+    keys = new[KEY_COLUMN].astype(str).to_numpy()
+    for col in new.columns:
+        same = (old[col] == new[col]).to_numpy(dtype=bool) | (old[col].isna() & new[col].isna()).to_numpy()
+        for pos in np.flatnonzero(~same):
+            changes.append({
+                "no": keys[pos],
+                "column": col,
+                "old": _plain(old[col].iat[pos]),
+                "new": _plain(new[col].iat[pos]),
+            })
+    return changes
+
+
+def patch_workbook(file_path, changes):
+    """Excelファイルの該当セルだけを書き換える（書式や他のシートはそのまま残る）"""
+    wb = load_workbook(file_path)
+    ws = wb.worksheets[0]
+
+    header = {cell.value: cell.column for cell in ws[1] if cell.value is not None}
+    key_col = header[KEY_COLUMN]
+    rows = {}
+    for (cell,) in ws.iter_rows(min_row=2, min_col=key_col, max_col=key_col):
+        if cell.value is not None:
+            rows[str(cell.value)] = cell.row
+
+    for change in changes:
+        ws.cell(row=rows[change["no"]], column=header[change["column"]], value=change["new"])
+    wb.save(file_path)
+
+
+def append_journal(original_file_path, entry):
+    entry = {"timestamp": datetime.datetime.now().isoformat(timespec="seconds"), **entry}
+    with open(journal_path(original_file_path), "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+    return entry["timestamp"]
+
+
+def read_journal(original_file_path):
+    path = journal_path(original_file_path)
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def rebuild_version(original_file_path, timestamp, read_excel):
+    """timestamp 時点（その時刻までの保存を反映した状態）の表を復元して返す
+
+    read_excel はファイルパスを受け取って DataFrame を返す関数。
+    全体保存の記録をまたぐ場合は、そのとき取った丸ごとのバックアップから巻き戻しを続ける。
+    """
+    df = read_excel(original_file_path)
+    for entry in reversed(read_journal(original_file_path)):
+        if entry["timestamp"] <= timestamp:
+            break
+        if entry.get("backup"):
+            df = read_excel(entry["backup"])
+            continue
+        rows = {no: i for i, no in enumerate(df[KEY_COLUMN].astype(str))}
+        changes = [c for c in entry.get("changes", []) if c["column"] in df.columns]
+        for col in {c["column"] for c in changes}:
+            df[col] = df[col].astype(object)
+        for change in changes:
+            df.iat[rows[change["no"]], df.columns.get_loc(change["column"])] = change["old"]
+    return df
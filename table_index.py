@@ -0,0 +1,123 @@
+from collections import defaultdict
+import re
+
+import numpy as np
+import pandas as pd
+
+# ==========================================
+# 🔎 絞り込み用インデックス
+# ==========================================
+# 読み込み時に1度だけ作り、編集された行だけを更新する。
+# ・グループ / 印刷状態 … 値ごとのビットマップ（bool配列）
+# ・名前 … 1文字・2文字のn-gramから行番号への転置インデックス（日本語の名前もそのまま扱える）
+
+CATEGORY_COLUMNS = ["グループ", "印刷状態"]
+NAME_COLUMN = "名前"
+# 編集で作り直しを保留している行がこれを超えたら、名前インデックスを作り直す
+REBUILD_THRESHOLD = 1000
+_REGEX_CHARS = re.compile(r"[.^$*+?{}\[\]\\|()]")
+
+
+def _name_texts(df):
+    if NAME_COLUMN not in df.columns:
+        return np.full(len(df), "", dtype=object)
+    return df[NAME_COLUMN].astype(str).fillna("").to_numpy(dtype=object)
+
+
+def _grams(text):
+    grams = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    return grams
+
+
+class TableIndex:
+    def __init__(self, df):
+        self.size = len(df)
+        self.bitmaps = {}
+        for col in CATEGORY_COLUMNS:
+            if col in df.columns:
+                self.bitmaps[col] = self._build_bitmaps(df[col])
+        self.names = _name_texts(df)
+        self._build_name_index()
+
+    @staticmethod
+    def _build_bitmaps(series):
+        codes, uniques = pd.factorize(series)
+        return {value: codes == i for i, value in enumerate(uniques)}
+
+    def _build_name_index(self):
+        postings = defaultdict(list)
+        for pos, name in enumerate(self.names):
+            for gram in _grams(name):
+                postings[gram].append(pos)
+        self.postings = {gram: np.array(rows, dtype=np.int64) for gram, rows in postings.items()}
+        # インデックスを作ったあとに編集された行（検索時は必ず候補に入れて実際の名前で確かめる）
+        self.dirty = set()
+
+    def update_rows(self, df, positions):
+        """df の positions 行目が編集されたときに、その行の分だけインデックスを更新する"""
+        positions = list(positions)
+        if not positions:
+            return
+        for col, bitmaps in self.bitmaps.items():
+            values = df[col].iloc[positions]
+            for bitmap in bitmaps.values():
+                bitmap[positions] = False
+            for pos, value in zip(positions, values):
+                if pd.isna(value):
+                    continue
+                if value not in bitmaps:
+                    bitmaps[value] = np.zeros(self.size, dtype=bool)
+                bitmaps[value][pos] = True
+
+        self.names[positions] = _name_texts(df.iloc[positions])
+        self.dirty.update(positions)
+        if len(self.dirty) > REBUILD_THRESHOLD:
+            self._build_name_index()
+
+    def category_mask(self, col, values):
+        mask = np.zeros(self.size, dtype=bool)
+        for value in values:
+            bitmap = self.bitmaps.get(col, {}).get(value)
+            if bitmap is not None:
+                mask |= bitmap
+        return mask
+
+    def search_name(self, query):
+        """名前に query を含む行の位置（昇順の配列）を返す"""
+        if _REGEX_CHARS.search(query):
+            # 正規表現として解釈される検索語は、従来どおり全件に対して照合する
+            pattern = re.compile(query)
+            return np.array(
+                [pos for pos, name in enumerate(self.names) if pattern.search(name)],
+                dtype=np.int64,
+            )
+
+        grams = [query] if len(query) == 1 else [query[i:i + 2] for i in range(len(query) - 1)]
+        candidates = None
+        for gram in grams:
+            rows = self.postings.get(gram, np.empty(0, dtype=np.int64))
+            candidates = rows if candidates is None else np.intersect1d(candidates, rows, assume_unique=True)
+            if len(candidates) == 0:
+                break
+        if self.dirty:
+            candidates = np.union1d(candidates, np.fromiter(self.dirty, dtype=np.int64))
+
+        return np.array(
+            [pos for pos in candidates if query in self.names[pos]],
+            dtype=np.int64,
+        )
+
+    def filter_positions(self, groups=None, statuses=None, search_name=None):
+        """条件に合う行の位置（昇順の配列）を返す"""
+        mask = None
+        if groups:
+            mask = self.category_mask("グループ", groups)
+        if statuses:
+            status_mask = self.category_mask("印刷状態", statuses)
+            mask = status_mask if mask is None else mask & status_mask
+
+        positions = np.flatnonzero(mask) if mask is not None else np.arange(self.size)
+        if search_name:
+            positions = np.intersect1d(positions, self.search_name(search_name), assume_unique=True)
+        return positions